@@ -5,7 +5,9 @@ Cada tool es una función que el agente puede invocar para interactuar con servi
 from langchain_core.tools import tool
 from loguru import logger
 from datetime import datetime
-from typing import Optional,  Dict, Any
+from typing import Optional,  Dict, Any, Tuple
+import threading
+import time
 
 from src.database.connection import get_supabase
 from src.config.settings import settings
@@ -179,6 +181,19 @@ def lookup_resident(condominium_id: str, query: str) -> Dict[str, Any]:
         return {"found": False, "error": str(e)}
 
 
+# Cache de pre-autorizaciones: el agente re-verifica la misma cedula durante
+# la llamada. Solo se cachean resultados negativos (ni positivos ni errores):
+# las pre-autorizaciones se revocan/editan directo en Supabase, sin un hook
+# que invalide el cache, y un positivo viejo abriria el porton. El TTL corto
+# acota cuanto tarda en verse una pre-autorizacion recien creada.
+PRE_AUTH_CACHE_TTL = 15  # segundos
+PRE_AUTH_CACHE_MAXSIZE = 10_000
+
+# (condominium_id, cedula) -> (expira_en, resultado)
+_pre_auth_cache: Dict[Tuple[str, str], Tuple[float, Dict[str, Any]]] = {}
+_pre_auth_lock = threading.Lock()  # los tools corren en threads (asyncio.to_thread)
+
+
 @tool
 def check_pre_authorized_visitor(condominium_id: str, cedula: str) -> Dict[str, Any]:
     """
@@ -192,6 +207,28 @@ def check_pre_authorized_visitor(condominium_id: str, cedula: str) -> Dict[str,
         dict con: authorized (bool), resident_id, resident_name,
         valid_until, notes
     """
+    key = (condominium_id, cedula)
+
+    with _pre_auth_lock:
+        cached = _pre_auth_cache.get(key)
+    if cached and cached[0] > time.monotonic():
+        logger.debug(f"Pre-autorización negativa cacheada: {cedula}")
+        return dict(cached[1])
+
+    result = _query_pre_authorization(condominium_id, cedula)
+
+    if not result.get("authorized") and "error" not in result:
+        with _pre_auth_lock:
+            if len(_pre_auth_cache) >= PRE_AUTH_CACHE_MAXSIZE:
+                # Desalojar la entrada mas vieja (orden de insercion)
+                _pre_auth_cache.pop(next(iter(_pre_auth_cache)))
+            _pre_auth_cache[key] = (time.monotonic() + PRE_AUTH_CACHE_TTL, result)
+
+    return dict(result)
+
+
+def _query_pre_authorization(condominium_id: str, cedula: str) -> Dict[str, Any]:
+    """Consulta la pre-autorización en Supabase (sin cache)."""
     logger.info(f"🪪 Verificando pre-autorización: {cedula}")
 
     # Detectar modo mock
@@ -11,6 +11,8 @@ from loguru import logger
 
 from src.config.settings import settings
 from src.api.routes import webhooks, vision, admin, tools, voice, condominiums, vehicles, monitoring, bitacora
+from src.services.voice.ultravox_client import close_ultravox_client
+from src.services.voice.webhook_handler import close_session_store, start_transcript_drainer
 
 
 # ============================================
@@ -26,11 +28,14 @@ async def lifespan(app: FastAPI):
     logger.info(f"Environment: {settings.environment}")
     logger.info(f"LLM Provider: {settings.llm_provider}")
     logger.info(f"Model: {settings.llm_model}")
+    start_transcript_drainer()
 
     yield
 
     # SHUTDOWN
     logger.info("🛑 Apagando SITNOVA Agent...")
+    await close_ultravox_client()
+    await close_session_store()
 
 
 # ============================================
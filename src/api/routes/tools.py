@@ -20,6 +20,7 @@ from loguru import logger
 import json
 import unicodedata
 import difflib
+from functools import lru_cache
 import re
 
 
@@ -33,13 +34,24 @@ from src.config.settings import settings
 from src.services.messaging.evolution_client import create_evolution_client, EvolutionConfig
 from src.api.routes.auth_state import set_pending_authorization, get_authorization_by_apartment
 from src.api.routes.condo_config import get_condo_config, CondoConfig
+from src.services.voice.prompts import WAIT_TIMEOUT_S, get_wait_message
+
+
+# Acentos del español precalculados: un solo str.translate en C
+_ACCENT_TABLE = str.maketrans(
+    "áéíóúÁÉÍÓÚñÑüÜàèìòùÀÈÌÒÙâêîôûÂÊÎÔÛ",
+    "aeiouAEIOUnNuUaeiouAEIOUaeiouAEIOU",
+)
 
 
 def normalize_text(text: str) -> str:
     """Remove accents and normalize text for search."""
     if not text:
         return text
-    # Normalize unicode and remove accents
+    text = text.translate(_ACCENT_TABLE)
+    if text.isascii():
+        return text
+    # Fallback: caracteres fuera de la tabla (otros acentos, marcas combinantes)
     normalized = unicodedata.normalize('NFD', text)
     return ''.join(c for c in normalized if unicodedata.category(c) != 'Mn')
 
@@ -255,24 +267,15 @@ def apply_all_phonetic_corrections(text: str) -> str:
     return " ".join(corrected_words)
 
 
-def generate_phonetic_variations(text: str, max_variations: int = 5) -> List[str]:
+def generate_phonetic_variations_set(text: str, max_variations: int = 5) -> frozenset:
     """
-    Genera variaciones fonéticas de un texto para matching más robusto.
+    Igual que generate_phonetic_variations, pero retorna un frozenset.
 
-    Ejemplos:
-        "Daisy" → ["Daisy", "Deisy", "Daisi"]
-        "Deisy" → ["Deisy", "Daisy", "Deisi"]
-        "Victoria" → ["Victoria", "Bictoria"]
-
-    Args:
-        text: Texto a variar
-        max_variations: Máximo de variaciones a generar
-
-    Returns:
-        Lista de variaciones fonéticas (incluye el original)
+    Para los matchings por pertenencia: `a & b` compara dos sets de
+    variaciones en una sola operación en lugar de un loop anidado.
     """
     if not text:
-        return [text]
+        return frozenset((text,))
 
     # Normalizar primero (quitar acentos)
     text_normalized = normalize_text(text.lower().strip())
@@ -280,9 +283,14 @@ def generate_phonetic_variations(text: str, max_variations: int = 5) -> List[str
     # Siempre incluir el original
     variations = {text_normalized}
 
-    # Aplicar cada patrón de variación
+    # Una sola pasada: caracteres y bigramas presentes en el texto (todos los
+    # patrones de PHONETIC_VARIATIONS tienen 1 o 2 caracteres)
+    present = set(text_normalized)
+    present.update(map(str.__add__, text_normalized, text_normalized[1:]))
+
+    # Aplicar cada patrón de variación (en orden, para respetar max_variations)
     for pattern_from, pattern_to in PHONETIC_VARIATIONS:
-        if pattern_from in text_normalized:
+        if pattern_from in present:
             # Generar variación reemplazando el patrón
             variation = text_normalized.replace(pattern_from, pattern_to)
             variations.add(variation)
@@ -291,7 +299,39 @@ def generate_phonetic_variations(text: str, max_variations: int = 5) -> List[str
             if len(variations) >= max_variations:
                 break
 
-    return list(variations)
+    return frozenset(variations)
+
+
+def generate_phonetic_variations(text: str, max_variations: int = 5) -> List[str]:
+    """
+    Genera variaciones fonéticas de un texto para matching más robusto.
+
+    Ejemplos:
+        "Daisy" → ["Daisy", "Deisy", "Daisi"]
+        "Deisy" → ["Deisy", "Daisy", "Deisi"]
+        "Victoria" → ["Victoria", "Bictoria"]
+
+    Args:
+        text: Texto a variar
+        max_variations: Máximo de variaciones a generar
+
+    Returns:
+        Lista de variaciones fonéticas (incluye el original)
+    """
+    return list(generate_phonetic_variations_set(text, max_variations))
+
+
+@lru_cache(maxsize=4096)
+def get_name_phonetic_index(full_name: str) -> frozenset:
+    """
+    Variaciones fonéticas de todas las palabras de un nombre ya normalizado.
+
+    Los nombres de residentes casi nunca cambian, así que se calculan una vez
+    por nombre y cada búsqueda hace un lookup en el set en lugar de regenerarlas.
+    """
+    return frozenset().union(
+        *map(generate_phonetic_variations_set, full_name.split())
+    )
 
 
 def fuzzy_match_name(query: str, candidates: List[str], threshold: float = 0.6) -> List[Tuple[str, float]]:
@@ -1538,24 +1578,23 @@ async def buscar_residente(
             nombres_db = [r.get("full_name", "") for r in all_residents.data]
 
             # 1. Intentar match exacto primero (con variaciones fonéticas)
+            # Términos de búsqueda con sus variaciones fonéticas (una vez por request)
+            search_terms_with_variations = []
+            if nombre_clean:
+                search_terms_with_variations.append(
+                    generate_phonetic_variations_set(normalize_text(nombre_clean.lower()))
+                )
+            if apellido_clean:
+                search_terms_with_variations.append(
+                    generate_phonetic_variations_set(normalize_text(apellido_clean.lower()))
+                )
+
             exact_matches = []
             for r in all_residents.data:
                 full_name = normalize_text(r.get("full_name", "").lower())
 
-                # Preparar términos de búsqueda con sus variaciones fonéticas
-                search_terms_with_variations = []
-                if nombre_clean:
-                    nombre_variations = generate_phonetic_variations(normalize_text(nombre_clean.lower()))
-                    search_terms_with_variations.append(nombre_variations)
-                if apellido_clean:
-                    apellido_variations = generate_phonetic_variations(normalize_text(apellido_clean.lower()))
-                    search_terms_with_variations.append(apellido_variations)
-
-                # Generar variaciones del nombre completo en DB también
-                full_name_words = full_name.split()
-                full_name_variations_by_word = [
-                    generate_phonetic_variations(word) for word in full_name_words
-                ]
+                # Variaciones de las palabras del nombre en DB (cacheadas por nombre)
+                full_name_variations = get_name_phonetic_index(full_name)
 
                 # Match si CUALQUIER variación de cada término de búsqueda está en CUALQUIER variación del nombre completo
                 if search_terms_with_variations:
@@ -1565,20 +1604,20 @@ async def buscar_residente(
                         # Verificar si al menos una variación del término se encuentra en el nombre
                         term_match = False
                         matched_var = None
-                        for variation in search_term_variations:
-                            # Buscar en el nombre completo o en sus palabras individuales
-                            if variation in full_name:
-                                term_match = True
-                                matched_var = variation
-                                break
-                            # También buscar por palabra (para manejar nombres compuestos)
-                            for word_variations in full_name_variations_by_word:
-                                if variation in word_variations:
-                                    term_match = True
-                                    matched_var = variation
-                                    break
-                            if term_match:
-                                break
+                        # Por palabra (nombres compuestos): intersección de sets
+                        common = search_term_variations & full_name_variations
+                        # min(): el orden de un set varia entre procesos (hash
+                        # randomization); asi la variacion reportada es estable
+                        if common:
+                            term_match = True
+                            matched_var = min(common)
+                        else:
+                            # Substring del nombre completo
+                            matched_var = min(
+                                (v for v in search_term_variations if v in full_name),
+                                default=None,
+                            )
+                            term_match = matched_var is not None
 
                         if term_match:
                             matched_variations.append(matched_var)
@@ -1846,7 +1885,6 @@ async def estado_autorizacion(
                 # Calcular tiempo de espera para dar mensaje contextual
                 timestamp_str = auth.get("timestamp", "")
                 wait_seconds = 0
-                wait_message = "Estoy contactando al residente, un momento por favor."
 
                 if timestamp_str:
                     try:
@@ -1864,23 +1902,13 @@ async def estado_autorizacion(
                         logger.warning(f"Error parseando timestamp: {e}")
                         wait_seconds = 0
 
-                # Mensajes contextuales según tiempo de espera
-                if wait_seconds < 15:
-                    wait_message = "Estoy contactando al residente, un momento por favor."
-                elif wait_seconds < 30:
-                    wait_message = "El residente está revisando la solicitud."
-                elif wait_seconds < 60:
-                    wait_message = "Seguimos esperando la respuesta del residente. Gracias por su paciencia."
-                elif wait_seconds < 120:
-                    wait_message = "El residente aún no responde. ¿Desea seguir esperando o prefiere dejar un mensaje?"
-                else:
-                    # Más de 2 minutos - ofrecer alternativas
-                    wait_message = "No hemos podido contactar al residente. Puede intentar comunicarse directamente o volver más tarde."
+                # Mensaje contextual según tiempo de espera (WAIT_SCHEDULE, sin LLM)
+                wait_message = get_wait_message(wait_seconds)
 
                 logger.info(f"⏳ Estado: PENDIENTE para {apt} (espera: {wait_seconds:.0f}s)")
 
                 # Determinar next_action basado en tiempo de espera
-                if wait_seconds < 120:
+                if wait_seconds < WAIT_TIMEOUT_S:
                     next_action = "KEEP CALLING estado_autorizacion - RESPONSE STILL PENDING"
                 else:
                     next_action = "OFFER TO TRANSFER TO OPERATOR - TIMEOUT EXCEEDED"
@@ -3,6 +3,7 @@ API Routes para gestion de llamadas de voz con Ultravox.
 Permite iniciar, monitorear y terminar llamadas del portero virtual.
 """
 from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 from typing import Optional, Dict, Any
 from datetime import datetime
@@ -14,7 +15,9 @@ from src.services.voice.ultravox_client import (
     get_ultravox_client,
     UltravoxClient,
     UltravoxCall,
+    UltravoxUnavailableError,
 )
+from src.services.voice.prompts import VisitorContext
 from src.services.voice.astersipvox_client import (
     get_astersipvox_client,
     AsterSIPVoxClient,
@@ -24,7 +27,8 @@ from src.services.voice.webhook_handler import (
     get_session_transcript,
 )
 
-router = APIRouter()
+# Respuestas con orjson: transcripciones y listados de sesiones son dicts grandes
+router = APIRouter(default_response_class=ORJSONResponse)
 
 
 # ============================================
@@ -118,11 +122,10 @@ async def create_voice_call(
     session_id = f"portero-{uuid.uuid4().hex[:8]}"
 
     # Contexto del visitante
-    visitor_context = {}
-    if request.visitor_plate:
-        visitor_context["plate"] = request.visitor_plate
-    if request.visitor_name:
-        visitor_context["name"] = request.visitor_name
+    visitor_context = VisitorContext(
+        plate=request.visitor_plate or None,
+        name=request.visitor_name or None,
+    )
 
     try:
         if request.use_sip and request.sip_uri:
@@ -151,6 +154,10 @@ async def create_voice_call(
             message="Llamada creada exitosamente. Use join_url para conectar.",
         )
 
+    except UltravoxUnavailableError as e:
+        # Circuito abierto: Ultravox caido, no un error nuestro
+        logger.warning(str(e))
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         logger.error(f"Error creando llamada: {e}")
         raise HTTPException(
@@ -190,11 +197,10 @@ async def create_sip_call(
     session_id = f"sip-{uuid.uuid4().hex[:8]}"
 
     # Contexto del visitante
-    visitor_context = {}
-    if request.visitor_plate:
-        visitor_context["plate"] = request.visitor_plate
-    if request.visitor_name:
-        visitor_context["name"] = request.visitor_name
+    visitor_context = VisitorContext(
+        plate=request.visitor_plate or None,
+        name=request.visitor_name or None,
+    )
 
     try:
         logger.info(f"Iniciando llamada SIP a: {sip_uri}")
@@ -202,7 +208,7 @@ async def create_sip_call(
         call = await client.create_sip_call(
             session_id=session_id,
             sip_uri=sip_uri,
-            visitor_context=visitor_context if visitor_context else None,
+            visitor_context=visitor_context,
         )
 
         logger.success(f"Llamada SIP creada: {call.call_id}")
@@ -215,6 +221,9 @@ async def create_sip_call(
             message=f"Llamada SIP creada. Ultravox llamara a {sip_uri}",
         )
 
+    except UltravoxUnavailableError as e:
+        logger.warning(str(e))
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         logger.error(f"Error creando llamada SIP: {e}")
         raise HTTPException(
@@ -306,6 +315,9 @@ async def get_call_status(call_id: str):
             transcript_count=len(status.get("messages", [])),
         )
 
+    except UltravoxUnavailableError as e:
+        logger.warning(str(e))
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         logger.error(f"Error obteniendo estado: {e}")
         raise HTTPException(
@@ -329,6 +341,9 @@ async def end_voice_call(call_id: str):
         else:
             raise HTTPException(status_code=500, detail="Error terminando llamada")
 
+    except UltravoxUnavailableError as e:
+        logger.warning(str(e))
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         logger.error(f"Error terminando llamada: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -341,7 +356,7 @@ async def get_call_transcript(call_id: str):
     Primero busca en sesiones activas, luego en Ultravox API.
     """
     # Primero buscar en sesiones locales
-    local_transcript = get_session_transcript(call_id)
+    local_transcript = await get_session_transcript(call_id)
     if local_transcript:
         return {
             "call_id": call_id,
@@ -358,6 +373,9 @@ async def get_call_transcript(call_id: str):
             "source": "ultravox",
             "transcript": transcript,
         }
+    except UltravoxUnavailableError as e:
+        logger.warning(str(e))
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         logger.error(f"Error obteniendo transcripcion: {e}")
         raise HTTPException(status_code=404, detail="Transcripcion no encontrada")
@@ -369,7 +387,7 @@ async def list_active_sessions():
     Lista todas las sesiones de voz activas.
     Util para monitoreo y debugging.
     """
-    sessions = get_active_sessions()
+    sessions = await get_active_sessions()
     return {
         "count": len(sessions),
         "sessions": sessions,
@@ -408,7 +426,11 @@ async def simulate_visitor_arrival(
     try:
         call = await client.create_call(
             session_id=session_id,
-            visitor_context=visitor_context,
+            visitor_context=VisitorContext(
+                plate=plate,
+                name=visitor_name,
+                vehicle_type=visitor_context["vehicle_type"],
+            ),
         )
 
         return {
@@ -420,6 +442,9 @@ async def simulate_visitor_arrival(
             "instructions": "Abre join_url en un navegador para simular la conversacion",
         }
 
+    except UltravoxUnavailableError as e:
+        logger.warning(str(e))
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         logger.error(f"Error en simulacion: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -5,9 +5,11 @@ Webhooks para integraciones externas:
 - Evolution API (WhatsApp responses)
 """
 from fastapi import APIRouter, Request, HTTPException, Header
+from fastapi.responses import ORJSONResponse
 from typing import Optional, Annotated
 from datetime import datetime
 from loguru import logger
+import orjson
 
 from src.config.settings import settings
 from src.services.voice.webhook_handler import (
@@ -167,8 +169,10 @@ router = APIRouter()
 # ============================================
 # ULTRAVOX WEBHOOKS
 # ============================================
+# Respuestas serializadas con orjson (eventos y sesiones son dicts anidados
+# con keys str); el resto de webhooks sigue con el JSONResponse por defecto
 
-@router.post("/ultravox")
+@router.post("/ultravox", response_class=ORJSONResponse)
 async def ultravox_webhook(
     request: Request,
     x_webhook_signature: Annotated[Optional[str], Header()] = None,
@@ -193,8 +197,12 @@ async def ultravox_webhook(
     #     raise HTTPException(status_code=401, detail="Invalid webhook signature")
     logger.info("Webhook signature validation bypassed (testing mode)")
 
-    # Parsear payload
-    payload = await request.json()
+    # Parsear payload (del body ya leido, sin segundo parseo via request.json())
+    try:
+        payload = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid JSON payload")
+
     event = payload.get("event", "unknown")
     call_id = payload.get("callId", payload.get("call_id", "unknown"))
     data = payload.get("data", payload)
@@ -211,7 +219,7 @@ async def ultravox_webhook(
     }
 
 
-@router.get("/ultravox/sessions")
+@router.get("/ultravox/sessions", response_class=ORJSONResponse)
 async def get_ultravox_sessions():
     """
     Endpoint de debug para ver sesiones activas.
@@ -221,7 +229,7 @@ async def get_ultravox_sessions():
         raise HTTPException(status_code=404, detail="Not found")
 
     return {
-        "active_sessions": get_active_sessions(),
+        "active_sessions": await get_active_sessions(),
     }
 
 
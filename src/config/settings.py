@@ -86,6 +86,7 @@ class Settings(BaseSettings):
     ultravox_webhook_secret: str = ""
     ultravox_voice: str = "es-CR-SofiaNeural"  # Voz en español Costa Rica
     ultravox_model: str = "fixie-ai/ultravox-v0_2"
+    ultravox_compact_prompt: bool = False  # System prompt compacto (menos tokens de prefill)
 
     # ============================================
     # ASTERSIPVOX (Bridge FreePBX <-> Ultravox)
@@ -7,6 +7,7 @@ from src.services.voice.ultravox_client import (
     UltravoxCall,
     UltravoxCallConfig,
     UltravoxWebhookEvent,
+    UltravoxUnavailableError,
     get_ultravox_client,
 )
 from src.services.voice.webhook_handler import (
@@ -22,6 +23,7 @@ __all__ = [
     "UltravoxCall",
     "UltravoxCallConfig",
     "UltravoxWebhookEvent",
+    "UltravoxUnavailableError",
     "get_ultravox_client",
     # Webhook Handler
     "process_ultravox_webhook",
@@ -390,27 +390,22 @@ class AsterSIPVoxClient:
         para darle contexto sobre el visitante actual.
         Usa el prompt centralizado de src/services/voice/prompts.py
         """
-        # Extraer datos del contexto del visitante
-        plate = visitor_context.get("plate") if visitor_context else None
-        name = visitor_context.get("name") if visitor_context else None
-        vehicle_type = visitor_context.get("vehicle_type") if visitor_context else None
-        resident_name = visitor_context.get("resident_name") if visitor_context else None
-        apartment = visitor_context.get("apartment") if visitor_context else None
-
-        # Usar el prompt centralizado
+        ctx = visitor_context or {}
+
+        # Usar el prompt centralizado (cacheado por combinacion de datos)
         base_prompt = get_full_system_prompt(
-            plate=plate,
-            name=name,
-            vehicle_type=vehicle_type,
-            resident_name=resident_name,
-            apartment=apartment,
+            plate=ctx.get("plate"),
+            name=ctx.get("name"),
+            vehicle_type=ctx.get("vehicle_type"),
+            resident_name=ctx.get("resident_name"),
+            apartment=ctx.get("apartment"),
         )
 
         # Agregar prompt personalizado si existe (para casos especiales)
-        if custom_prompt:
-            base_prompt += f"\n\nINSTRUCCIONES ADICIONALES:\n{custom_prompt}"
+        if not custom_prompt:
+            return base_prompt
 
-        return base_prompt
+        return f"{base_prompt}\n\nINSTRUCCIONES ADICIONALES:\n{custom_prompt}"
 
 
 # ============================================
@@ -4,382 +4,175 @@ Prompts centralizados para el agente de voz SITNOVA.
 Este archivo contiene todos los prompts del sistema para el portero virtual.
 Centralizar aquí permite fácil mantenimiento y evita duplicación.
 """
+import bisect
+import re
+import sys
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from importlib import resources
+from types import MappingProxyType
+from typing import Iterable, Optional
+
+from loguru import logger
+
+
+def _frozen(mapping: dict[str, str]) -> MappingProxyType:
+    """Vista de solo lectura con keys y valores internados (una sola copia por frase)."""
+    return MappingProxyType({sys.intern(k): sys.intern(v) for k, v in mapping.items()})
+
 
 # ============================================
 # SYSTEM PROMPT PRINCIPAL DEL PORTERO - V13
 # ============================================
 # Optimizado para: Búsqueda por nombre, Memoria mejorada, Cédula clara, Manejo "no sé casa"
+# Consolidado: cada regla aparece una sola vez (menos tokens de prefill por llamada)
+# El texto vive en portero_v13.txt y se carga una sola vez al importar el modulo
+
+SYSTEM_PROMPT_PORTERO = (
+    resources.files(__package__) / "portero_v13.txt"
+).read_text(encoding="utf-8")
+
+
+# ============================================
+# MODULOS DEL PROMPT
+# ============================================
+# Cada bloque <tag>...</tag> del prompt es un modulo estatico. Exponerlos por
+# separado permite cachear/invalidar cada modulo de forma independiente en el
+# proveedor (ej. solo <tools> cuando cambia la lista de tools).
+
+_MODULE_RE = re.compile(r"<(\w+)>\n.*?\n</\1>", re.DOTALL)
+
+PROMPT_MODULES = _frozen({
+    match.group(1): match.group(0)
+    for match in _MODULE_RE.finditer(SYSTEM_PROMPT_PORTERO)
+})
+
+
+def assemble_prompt(modules: Optional[Iterable[str]] = None, visitor_ctx: str = "") -> str:
+    """
+    Ensambla el system prompt a partir de sus modulos.
+
+    Args:
+        modules: Nombres de los modulos a incluir (None = todos)
+        visitor_ctx: Contexto del visitante a agregar al final
+
+    Returns:
+        Prompt con los modulos en el orden canonico de SYSTEM_PROMPT_PORTERO
+    """
+    selected = PROMPT_MODULES.keys() if modules is None else set(modules)
+
+    unknown = selected - PROMPT_MODULES.keys()
+    if unknown:
+        raise KeyError(f"Modulos de prompt desconocidos: {sorted(unknown)}")
+
+    blocks = [block for name, block in PROMPT_MODULES.items() if name in selected]
+    return "\n\n".join(blocks) + "\n" + visitor_ctx
 
-SYSTEM_PROMPT_PORTERO = """<role>
-Eres el portero virtual de un condominio residencial en Costa Rica. Tu trabajo es verificar visitantes y controlar el acceso de manera profesional, amable y eficiente.
-</role>
-
-<tone>
-SIEMPRE usar tono formal pero amable:
-- "Con mucho gusto"
-- "Por favor"
-- "Gracias por esperar"
-- "¿Me permite su...?"
-- "Permítame verificar"
-</tone>
-
-<critical_rules>
-1. NUNCA quedarte en silencio. Si no sabes que hacer, transfiere a operador.
-2. NUNCA inventar informacion. Solo usa datos de las tools.
-3. NUNCA repetir la misma frase dos veces seguidas.
-4. NUNCA preguntar algo que el visitante ya dijo.
-5. UNA sola respuesta por turno - corta y directa.
-6. Siempre terminar las llamadas con hangUp o transfer_call.
-7. CAPTURAR informacion PASO A PASO - una pregunta a la vez.
-8. SI visitante dice nombre de residente -> BUSCAR con lookup_resident INMEDIATAMENTE.
-</critical_rules>
-
-<anti_silence>
-Si han pasado 3 segundos sin accion:
-- Tienes datos pendientes? Continua el flujo.
-- Esperando tool? Di "Un momento por favor..."
-- No sabes que hacer? Usa transfer_call a 1002 INMEDIATAMENTE.
-
-PROHIBIDO quedarse callado.
-</anti_silence>
-
-<greeting>
-SIEMPRE iniciar con:
-"[SALUDO_HORA], bienvenido a {{CONDOMINIUM_NAME}}. ¿A quién nos visita hoy?"
-
-Saludo segun hora (Costa Rica):
-- 05:00-11:59: "Buenos días"
-- 12:00-17:59: "Buenas tardes"
-- 18:00-04:59: "Buenas noches"
-</greeting>
-
-<language>
-Detecta idioma del visitante y responde en el mismo.
-</language>
-
-<memory_rules>
-RECUERDA TODO lo que el visitante dijo. NO preguntes de nuevo.
-
-INFORMACION A GUARDAR:
-1. RESIDENTE_BUSCADO: Nombre del residente que visita (ej: "DC Colorado", "María")
-2. NOMBRE_VISITANTE: Nombre del visitante (ej: "soy Juan", "me llamo Pedro")
-3. DESTINO: Número de casa (ej: "casa 5", "apartamento 10")
-4. CEDULA: Número de identificación
-5. MOTIVO: Razón de visita
-
-EJEMPLOS DE EXTRACCION:
-- "Busco a DC Colorado" -> RESIDENTE_BUSCADO = "DC Colorado"
-- "Vengo a ver a María" -> RESIDENTE_BUSCADO = "María"
-- "Soy Marito Mortadela" -> NOMBRE_VISITANTE = "Marito Mortadela"
-- "Casa 10" -> DESTINO = "10"
-- "No sé el número de casa" -> DESTINO = desconocido, USAR lookup_resident con RESIDENTE_BUSCADO
-
-CRITICO: Si ya tienes RESIDENTE_BUSCADO, NO preguntes "¿a quién visita?" de nuevo.
-</memory_rules>
-
-<step_by_step_capture>
-OBLIGATORIO: Capturar UNA pieza de informacion a la vez.
-
-INCORRECTO: "¿Me da su nombre, cédula y motivo de visita?"
-CORRECTO: Preguntar paso a paso:
-
-1. Si falta DESTINO pero tienes RESIDENTE_BUSCADO: Usa lookup_resident con el nombre
-2. Si falta NOMBRE_VISITANTE: "¿Su nombre completo?" [espera, guarda]
-3. Si falta CEDULA: "¿Número de cédula?" [espera, confirmar, guarda]
-4. Si falta MOTIVO: "¿Motivo de visita?" [espera, guarda]
-5. SOLO cuando tengas todo: Procede a notificar.
-</step_by_step_capture>
-
-<cedula_confirmation>
-CUANDO CONFIRMAR CEDULA:
-1. Escucha el número completo
-2. Repite LENTO, dígito por dígito, con pausas claras
-3. Formato: "Confirmo: [dígito]... [dígito]... [dígito]... ¿Correcto?"
-
-EJEMPLO CORRECTO:
-Visitante: "Mi cédula es 123456"
-Tu: "Confirmo: uno... dos... tres... cuatro... cinco... seis. ¿Correcto?"
-
-EJEMPLO INCORRECTO (NO HACER):
-- "Confirmo ciento veintitrés mil cuatrocientos..." (MAL - no decir como número)
-- "Unodostrescuatrocincoseis" (MAL - muy rápido, sin pausas)
-- "1-2-3-4-5-6" (MAL - no pronunciar dígitos)
-
-USAR NOMBRES DE DIGITOS:
-0=cero, 1=uno, 2=dos, 3=tres, 4=cuatro, 5=cinco, 6=seis, 7=siete, 8=ocho, 9=nueve
-</cedula_confirmation>
-
-<scenarios>
-=== DELIVERY / REPARTIDOR ===
-Uber Eats, Rappi, DHL, etc. NO requiere cédula.
-Visitante: "Delivery para casa 5"
-Tu: "Delivery para casa 5. ¿Su nombre?" -> notificar sin cédula
-
-=== UBER/TAXI CON PASAJERO ===
-Visitante: "Soy Uber, traigo pasajero"
-Tu: "Con gusto. ¿A qué número de casa se dirige el pasajero?"
-
-=== RESIDENTE OLVIDÓ LLAVE ===
-Visitante: "Soy residente, olvidé mi control"
-Tu: "Entendido. ¿Su nombre y número de casa?" -> verificar y notificar
-
-=== PERSONA PERDIDA ===
-Visitante: "Busco la farmacia"
-Tu: "Disculpe, esto es un condominio residencial. ¿Busca a algún residente?"
-Si dice no: "Entendido. Que tenga buen día." + hangUp
-
-=== VISITANTE SOLO SABE NOMBRE DEL RESIDENTE ===
-Visitante: "Busco a DC Colorado"
-Tu: [lookup_resident con "DC Colorado"] -> "DC Colorado en casa 15. ¿Su nombre?"
-</scenarios>
-
-<tools>
-HTTP Tools:
-- lookup_resident: Buscar residente POR NOMBRE o POR CASA (usar con nombre del residente o número)
-- verificar_preautorizacion: Verificar si visitante tiene pre-autorizacion
-- notificar_residente: Enviar WhatsApp al residente
-- estado_autorizacion: Verificar respuesta del residente
-- obtener_direccion: Obtener instrucciones de llegada
-- abrir_porton: Abrir el porton
-
-Built-in Tools:
-- hangUp: Termina la llamada
-- transfer_call: Transfiere a extension 1002 (operador)
-</tools>
-
-<flow>
-PASO 1 - SALUDO:
-"[Saludo], bienvenido a {{CONDOMINIUM_NAME}}. ¿A quién nos visita hoy?"
-
-PASO 2 - ANALIZAR RESPUESTA:
-Extraer de lo que dijo el visitante:
-- RESIDENTE_BUSCADO: nombre del residente que visita
-- DESTINO: número de casa si lo dijo
-- NOMBRE_VISITANTE: su nombre si lo dijo
-- MOTIVO: motivo si lo dijo
-
-PASO 3 - BUSCAR RESIDENTE:
-SI tienes RESIDENTE_BUSCADO (nombre del residente):
-  -> lookup_resident con el nombre
-  -> Guardar el apartamento que devuelve
-
-SI tienes DESTINO (número de casa):
-  -> lookup_resident con el número
-  -> Guardar el nombre del residente
-
-SI NO tienes ni nombre ni número:
-  -> Preguntar: "¿A qué número de casa se dirige?"
-
-PASO 4 - VERIFICAR PRE-AUTH (opcional):
-Si tienes NOMBRE_VISITANTE:
-  -> verificar_preautorizacion
-  -> Si autorizado: ir a PASO 8
-
-PASO 5 - COMPLETAR DATOS (uno a la vez):
-Si falta NOMBRE_VISITANTE: "¿Su nombre completo?"
-Si falta CEDULA: "¿Número de cédula?" -> confirmar dígito por dígito
-Si falta MOTIVO: "¿Motivo de visita?"
-
-PASO 6 - NOTIFICAR:
-Cuando tengas: apartamento, nombre_visitante, cedula, motivo
--> "Permítame notificar al residente..."
--> notificar_residente
-
-PASO 7 - ESPERAR RESPUESTA:
--> estado_autorizacion (cada 5 seg, max 6 veces = 30 seg)
-Mensajes variados: "Un momento...", "Esperando respuesta...", "Ya casi..."
-
-PASO 8 - AUTORIZADO:
--> "¡Excelente! Acceso autorizado. ¿Conoce cómo llegar?"
--> Si NO: obtener_direccion y leer instrucciones
--> abrir_porton
--> "Adelante, que tenga un excelente día."
--> hangUp INMEDIATAMENTE
-
-PASO 9 - DENEGADO:
--> "Lo siento, acceso denegado. Que tenga buen día."
--> hangUp INMEDIATAMENTE
-
-PASO 10 - SIN RESPUESTA (después de 6 intentos):
--> "El residente no responde. Le comunico con un operador."
--> transfer_call a 1002
-</flow>
-
-<no_house_number>
-CUANDO VISITANTE DICE "NO SÉ EL NÚMERO DE CASA":
-
-1. SI ya tienes RESIDENTE_BUSCADO:
-   -> Usar lookup_resident con el nombre del residente
-   -> Ejemplo: lookup_resident(query="DC Colorado")
-
-2. SI NO tienes nombre del residente:
-   -> Preguntar: "¿Cómo se llama la persona que visita?"
-   -> Guardar como RESIDENTE_BUSCADO
-   -> Usar lookup_resident con ese nombre
-
-NUNCA preguntar "¿a quién visita?" si ya te dijeron el nombre.
-</no_house_number>
-
-<transfer_rules>
-TRANSFERIR INMEDIATAMENTE (sin preguntar) cuando:
-- Residente no responde despues de 6 intentos de estado_autorizacion (30 segundos)
-- No puedes entender al visitante despues de 2 intentos
-- Visitante habla ininteligible
-- Error tecnico con las tools
-- Visitante pide operador
-- Cualquier situacion fuera de control
-
-COMO TRANSFERIR:
-1. Di: "Le comunico con un operador."
-2. Llama transfer_call con destination "1002"
-3. NO uses hangUp - la llamada se transfiere automaticamente
-</transfer_rules>
-
-<hangup_rules>
-COLGAR INMEDIATAMENTE despues de:
-- Abrir porton exitosamente (despues de despedida)
-- Denegar acceso (despues de despedida)
-- Error irrecuperable
-
-COMO COLGAR:
-1. Di tu despedida CORTA (maximo 5 palabras)
-2. Llama hangUp
-3. NO digas nada mas despues de hangUp
-
-PROHIBIDO: Dejar llamadas abiertas. Si termino el proceso, CUELGA.
-</hangup_rules>
-
-<response_rules>
-RESPUESTAS CORTAS - Maximo 15 palabras por turno.
-
-PROHIBIDO REPETIR:
-- NO: "Adelante, la puerta esta abierta. Bienvenido. Pase. La puerta esta abierta."
-- SI: "Adelante, buen dia." (y luego hangUp)
-
-UNA IDEA POR RESPUESTA:
-- NO: "Voy a buscar al residente, un momento, estoy buscando, ya casi..."
-- SI: "Buscando..." (y ejecuta la tool)
-
-PROHIBIDO:
-- Frases redundantes
-- Repetir lo que acabas de decir
-- Multiples despedidas
-- Explicaciones largas
-</response_rules>
-
-<examples>
---- EJEMPLO 1: Visitante da nombre de residente ---
-Tu: "Buenas tardes, bienvenido a Condominio Los Jardines. ¿A quién nos visita hoy?"
-Visitante: "Busco a DC Colorado"
-[GUARDAR: RESIDENTE_BUSCADO="DC Colorado"]
-[lookup_resident query="DC Colorado"] -> {nombre: "DC Colorado", apartamento: "15"}
-Tu: "DC Colorado en casa 15. ¿Su nombre?"
-Visitante: "Marito Mortadela"
-[GUARDAR: NOMBRE_VISITANTE="Marito Mortadela"]
-Tu: "¿Número de cédula?"
-Visitante: "123456"
-Tu: "Confirmo: uno... dos... tres... cuatro... cinco... seis. ¿Correcto?"
-Visitante: "Sí"
-[GUARDAR: CEDULA="123456"]
-Tu: "¿Motivo de visita?"
-Visitante: "Visita personal"
-[GUARDAR: MOTIVO="Visita personal"]
-Tu: "Permítame notificar al residente..."
-[notificar_residente]
-[estado_autorizacion] -> autorizado
-Tu: "¡Excelente! Acceso autorizado. ¿Conoce cómo llegar?"
-Visitante: "Sí"
-[abrir_porton]
-Tu: "Adelante, que tenga un excelente día."
-[hangUp]
-
---- EJEMPLO 2: Visitante no sabe número de casa ---
-Tu: "Buenos días, bienvenido a Residencial El Roble. ¿A quién nos visita hoy?"
-Visitante: "A María Rodríguez"
-[GUARDAR: RESIDENTE_BUSCADO="María Rodríguez"]
-[lookup_resident query="María Rodríguez"] -> {nombre: "María Rodríguez", apartamento: "8"}
-Tu: "María Rodríguez en casa 8. ¿Su nombre?"
-Visitante: "Pedro López. No sé el número de casa."
-[GUARDAR: NOMBRE_VISITANTE="Pedro López"]
-[Ya tienes el apartamento de lookup_resident: casa 8]
-Tu: "¿Número de cédula?"
-... continúa flujo normal ...
-
---- EJEMPLO 3: Solo da número de casa ---
-Tu: "Buenas noches, bienvenido a Las Palmas. ¿A quién nos visita hoy?"
-Visitante: "Casa 5"
-[GUARDAR: DESTINO="5"]
-[lookup_resident query="5"] -> {nombre: "Juan Pérez", apartamento: "5"}
-Tu: "Juan Pérez, casa 5. ¿Su nombre?"
-... continúa flujo normal ...
-
---- DELIVERY ---
-Tu: "Buenas noches, bienvenido a Residencial El Roble. ¿A quién nos visita hoy?"
-Visitante: "Delivery Uber Eats para casa 5"
-[lookup_resident] -> Juan Pérez, casa 5
-Tu: "Delivery para Juan Pérez, casa 5. ¿Su nombre?"
-Visitante: "Luis"
-Tu: "Permítame notificar al residente..."
-[notificar_residente con motivo="Delivery Uber Eats"]
-...
-
---- ACCESO DENEGADO ---
-[estado_autorizacion] -> denegado
-Tu: "Lo siento, el acceso no fue autorizado. Que tenga buen día."
-[hangUp]
-
---- SIN RESPUESTA (TRANSFERENCIA OBLIGATORIA) ---
-[estado_autorizacion x6 cada 5s = 30 segundos] -> pendiente
-Tu: "El residente no está respondiendo. Le comunico con un operador."
-[transfer_call destination=1002]
-
---- PERSONA PERDIDA ---
-Tu: "Buenas tardes, bienvenido a Las Palmas. ¿A quién nos visita hoy?"
-Visitante: "Busco una pizzería"
-Tu: "Disculpe, esto es un condominio residencial. ¿Busca a algún residente?"
-Visitante: "No, me equivoqué"
-Tu: "Entendido. Que tenga buen día."
-[hangUp]
-</examples>
-
-<forbidden>
-NUNCA hagas esto:
-- Inventar nombres de residentes
-- Inventar numeros de casa
-- Inventar direcciones
-- Quedarte en silencio
-- Dejar llamadas abiertas
-- Preguntar si quiere transferir (es obligatorio)
-- Repetir frases
-- Respuestas largas
-- Compartir numeros de telefono
-- Olvidar verificar pre-autorización cuando tienes nombre
-- Preguntar algo que el visitante ya dijo (especialmente nombre)
-- Decir solo "casa" en lugar de "¿a qué número de casa?"
-- Preguntar "¿a quién visita?" cuando ya te dieron el nombre del residente
-- Decir cédula como número grande (ej: "ciento veintitrés mil")
-</forbidden>
-"""
+
+# Variante compacta: <scenarios> queda solo con sus reglas (sin los dialogos
+# ilustrativos) y no se agregan los ejemplos few-shot salvo el del escenario
+# detectado. Reglas como "delivery NO requiere cedula" viven solo en este
+# modulo, asi que se conservan. Se activa con ULTRAVOX_COMPACT_PROMPT.
+_SCENARIOS_COMPACT = """<scenarios>
+- Delivery/repartidor (Uber Eats, Rappi, DHL, etc.): NO requiere cédula. Pedir nombre y notificar.
+- Uber/taxi con pasajero: preguntar a qué número de casa se dirige el pasajero.
+- Residente olvidó su llave/control: pedir nombre y número de casa, verificar y notificar.
+- Persona perdida: aclarar que es un condominio residencial; si no busca a un residente, despedirse y hangUp.
+- Solo sabe el nombre del residente: usar lookup_resident con ese nombre.
+</scenarios>"""
+
+SYSTEM_PROMPT_COMPACT = SYSTEM_PROMPT_PORTERO.replace(PROMPT_MODULES["scenarios"], _SCENARIOS_COMPACT)
+
+logger.debug(
+    f"System prompt: ~{len(SYSTEM_PROMPT_PORTERO) // 4} tokens "
+    f"(compacto: ~{len(SYSTEM_PROMPT_COMPACT) // 4} tokens)"
+)
+
+
+# ============================================
+# EJEMPLOS POR ESCENARIO (FEW-SHOT)
+# ============================================
+# Los ejemplos viven en portero_examples.txt (secciones "### <escenario>").
+# Con escenario detectado se inyecta solo su ejemplo, despues del contexto;
+# sin escenario (el caso normal al crear la llamada) van todos, como en el
+# prompt original, dentro del prefijo estatico (ver _RENDERED_PROMPTS).
+
+_EXAMPLE_RE = re.compile(r"^### (\w+)\n(.*?)(?=^### |\Z)", re.DOTALL | re.MULTILINE)
+
+_EXAMPLES = _frozen({
+    match.group(1): match.group(2).rstrip("\n")
+    for match in _EXAMPLE_RE.finditer(
+        (resources.files(__package__) / "portero_examples.txt").read_text(encoding="utf-8")
+    )
+})
+
+_ALL_EXAMPLES = "\n\n".join(_EXAMPLES.values())
+
+
+def build_example_block(scenario: Optional[str] = None) -> str:
+    """
+    Construye el bloque <examples> para un escenario.
+
+    Args:
+        scenario: delivery, resident_name, house_number, no_house_number,
+                  denied, no_response o lost
+
+    Returns:
+        Bloque con el ejemplo del escenario, o con todos los ejemplos si el
+        escenario es None o desconocido
+    """
+    example = _EXAMPLES.get(scenario, _ALL_EXAMPLES) if scenario else _ALL_EXAMPLES
+    return "\n\n<examples>\n" + example + "\n</examples>"
 
 
 # ============================================
 # MENSAJES DE ESPERA CONTEXTUALES
 # ============================================
 
-MENSAJES_ESPERA = {
+MENSAJES_ESPERA = _frozen({
     "inicial": "Estoy contactando al residente, un momento por favor.",
     "corto": "El residente está revisando la solicitud.",
     "medio": "Seguimos esperando la respuesta del residente. Gracias por su paciencia.",
     "largo": "El residente aún no responde. ¿Desea seguir esperando o prefiere dejar un mensaje?",
     "timeout": "No hemos podido contactar al residente. Puede intentar comunicarse directamente o volver más tarde.",
-}
+})
+
+# Escalamiento segun segundos desde que se notifico al residente (lo usa el
+# tool estado_autorizacion mientras la autorizacion sigue pendiente)
+WAIT_SCHEDULE: tuple[tuple[float, str], ...] = (
+    (0.0, MENSAJES_ESPERA["inicial"]),
+    (15.0, MENSAJES_ESPERA["corto"]),
+    (30.0, MENSAJES_ESPERA["medio"]),
+    (60.0, MENSAJES_ESPERA["largo"]),
+    (120.0, MENSAJES_ESPERA["timeout"]),
+)
+
+# Desde aqui ya no se sigue esperando: se ofrece el operador
+WAIT_TIMEOUT_S = WAIT_SCHEDULE[-1][0]
+
+_WAIT_TIMES = tuple(t for t, _ in WAIT_SCHEDULE)
+
+
+def get_wait_message(elapsed_s: float) -> str:
+    """
+    Selecciona el mensaje de espera sin pasar por el LLM.
+
+    Args:
+        elapsed_s: Segundos transcurridos desde que se notifico al residente
+
+    Returns:
+        Mensaje de MENSAJES_ESPERA correspondiente al tiempo de espera
+    """
+    index = bisect.bisect_right(_WAIT_TIMES, elapsed_s) - 1
+    return WAIT_SCHEDULE[max(index, 0)][1]
 
 
 # ============================================
 # RESPUESTAS PREDEFINIDAS
 # ============================================
 
-RESPUESTAS = {
+RESPUESTAS = _frozen({
     "saludo": "Buenas, ¿a quién visita?",
     "pedir_apellido": "¿El apellido?",
     "pedir_casa": "¿Número de casa?",
@@ -394,13 +187,112 @@ RESPUESTAS = {
     "ofrecer_operador": "¿Le comunico con un operador?",
     "transferir": "Le comunico con un operador.",
     "despedida_denegado": "Buen día.",
-}
+})
+
+
+# ============================================
+# SALUDO SEGUN HORA
+# ============================================
+# El saludo se resuelve en Python (no en el LLM) y se sustituye en [SALUDO_HORA].
+# Costa Rica es UTC-6 todo el año (sin horario de verano).
+
+COSTA_RICA_TZ = timezone(timedelta(hours=-6), "America/Costa_Rica")
+
+_GREETING_BY_HOUR = tuple(
+    "Buenos días" if 5 <= hour < 12 else "Buenas tardes" if 12 <= hour < 18 else "Buenas noches"
+    for hour in range(24)
+)
+
+# Un prompt pre-renderizado por (saludo, compacto, con todos los ejemplos): el
+# prefijo se mantiene estable para el cache. Sin escenario los ejemplos son
+# fijos y van en el prefijo, antes del contexto del visitante
+_RENDERED_PROMPTS = MappingProxyType({
+    (greeting, compact, all_examples): (
+        base.replace("[SALUDO_HORA]", greeting)
+        + (build_example_block() if all_examples else "")
+    )
+    for greeting in set(_GREETING_BY_HOUR)
+    for compact, base in ((False, SYSTEM_PROMPT_PORTERO), (True, SYSTEM_PROMPT_COMPACT))
+    for all_examples in ((False, True) if not compact else (False,))
+})
+
+
+def get_greeting(now: Optional[datetime] = None) -> str:
+    """
+    Retorna el saludo segun la hora de Costa Rica.
+
+    05:00-11:59 "Buenos días", 12:00-17:59 "Buenas tardes", 18:00-04:59 "Buenas noches".
+    """
+    now = now or datetime.now(COSTA_RICA_TZ)
+    return _GREETING_BY_HOUR[now.hour]
 
 
 # ============================================
 # PROMPT PARA CONTEXTO DE VISITANTE
 # ============================================
 
+@dataclass(frozen=True, slots=True)
+class VisitorContext:
+    """Datos conocidos del visitante (inmutable y hashable para cache)."""
+    plate: Optional[str] = None
+    name: Optional[str] = None
+    vehicle_type: Optional[str] = None
+    resident_name: Optional[str] = None
+    apartment: Optional[str] = None
+
+
+# Etiquetas fijas del contexto, en el mismo orden que los campos de VisitorContext
+_CONTEXT_LABELS = tuple(sys.intern(label) for label in (
+    "\n- Placa del vehículo: ",
+    "\n- Nombre del visitante: ",
+    "\n- Tipo de vehículo: ",
+    "\n- Dice que visita a: ",
+    "\n- Casa/Apartamento destino: ",
+))
+
+_CONTEXT_HEADER = "\nCONTEXTO DEL VISITANTE ACTUAL:"
+_CONTEXT_EMPTY = "\nCONTEXTO: Sin información previa del visitante."
+
+
+@lru_cache(maxsize=1024)
+def _build_visitor_context(ctx: VisitorContext) -> str:
+    """Formatea el contexto del visitante (cacheado por VisitorContext)."""
+    values = (ctx.plate, ctx.name, ctx.vehicle_type, ctx.resident_name, ctx.apartment)
+    body = "".join(
+        label + str(value)
+        for value, label in zip(values, _CONTEXT_LABELS)
+        if value
+    )
+
+    if not body:
+        return _CONTEXT_EMPTY
+
+    return _CONTEXT_HEADER + body
+
+
+# Presupuesto del contexto del visitante (el system prompt nunca se recorta,
+# para no romper el cache de prefijo). Se estiman ~4 caracteres por token.
+MAX_CONTEXT_TOKENS = 256
+
+# Campos a descartar primero cuando el contexto excede el presupuesto
+_CONTEXT_DROP_ORDER = ("plate", "vehicle_type", "resident_name", "name", "apartment")
+
+
+def _build_visitor_context_within_budget(ctx: VisitorContext) -> str:
+    """Formatea el contexto descartando campos de menor prioridad si excede MAX_CONTEXT_TOKENS."""
+    context = _build_visitor_context(ctx)
+
+    for field in _CONTEXT_DROP_ORDER:
+        if len(context) // 4 <= MAX_CONTEXT_TOKENS:
+            break
+        if getattr(ctx, field):
+            logger.warning(f"Contexto del visitante excede {MAX_CONTEXT_TOKENS} tokens, descartando '{field}'")
+            ctx = replace(ctx, **{field: None})
+            context = _build_visitor_context(ctx)
+
+    return context
+
+
 def build_visitor_context_prompt(
     plate: str = None,
     name: str = None,
@@ -421,23 +313,42 @@ def build_visitor_context_prompt(
     Returns:
         String con el contexto formateado
     """
-    lines = []
+    return _build_visitor_context(VisitorContext(
+        plate=plate,
+        name=name,
+        vehicle_type=vehicle_type,
+        resident_name=resident_name,
+        apartment=apartment,
+    ))
 
-    if plate:
-        lines.append(f"- Placa del vehículo: {plate}")
-    if name:
-        lines.append(f"- Nombre del visitante: {name}")
-    if vehicle_type:
-        lines.append(f"- Tipo de vehículo: {vehicle_type}")
-    if resident_name:
-        lines.append(f"- Dice que visita a: {resident_name}")
-    if apartment:
-        lines.append(f"- Casa/Apartamento destino: {apartment}")
 
-    if not lines:
-        return "\nCONTEXTO: Sin información previa del visitante."
+@lru_cache(maxsize=256)
+def _get_full_system_prompt(
+    ctx: VisitorContext,
+    scenario: Optional[str],
+    greeting: str,
+    compact: bool,
+) -> str:
+    """Ensambla prompt + contexto (+ ejemplo del escenario), cacheado por combinacion."""
+    context = _build_visitor_context_within_budget(ctx)
+    if scenario in _EXAMPLES:
+        # Solo el ejemplo del escenario va despues del contexto
+        return _RENDERED_PROMPTS[(greeting, compact, False)] + context + build_example_block(scenario)
 
-    return "\nCONTEXTO DEL VISITANTE ACTUAL:\n" + "\n".join(lines)
+    # Sin escenario: todos los ejemplos ya estan en el prefijo (el compacto no los lleva)
+    return _RENDERED_PROMPTS[(greeting, compact, not compact)] + context
+
+
+def get_system_prompt_for_context(
+    ctx: VisitorContext,
+    scenario: str = None,
+    compact: bool = False,
+) -> str:
+    """
+    Igual que get_full_system_prompt, pero recibe el VisitorContext ya armado
+    (evita reconstruirlo en los clientes que lo reciben tipado).
+    """
+    return _get_full_system_prompt(ctx, scenario, get_greeting(), compact)
 
 
 def get_full_system_prompt(
@@ -446,14 +357,24 @@ def get_full_system_prompt(
     vehicle_type: str = None,
     resident_name: str = None,
     apartment: str = None,
+    scenario: str = None,
+    compact: bool = False,
 ) -> str:
     """
     Obtiene el prompt completo del sistema con contexto del visitante.
 
+    El resultado se cachea por combinacion de datos y saludo: el mismo visitante
+    reutiliza el string ya construido en lugar de recopiar todo el prompt.
+
+    Args:
+        scenario: Escenario detectado (ej. "delivery") para inyectar su ejemplo
+        compact: Usar SYSTEM_PROMPT_COMPACT (menos tokens de prefill; sin
+                 escenario no agrega ejemplos)
+
     Returns:
         System prompt completo listo para usar
     """
-    context = build_visitor_context_prompt(
+    ctx = VisitorContext(
         plate=plate,
         name=name,
         vehicle_type=vehicle_type,
@@ -461,4 +382,4 @@ def get_full_system_prompt(
         apartment=apartment,
     )
 
-    return SYSTEM_PROMPT_PORTERO + context
+    return get_system_prompt_for_context(ctx, scenario, compact)
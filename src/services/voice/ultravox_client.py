@@ -2,46 +2,174 @@
 Cliente de Ultravox Voice AI para SITNOVA.
 Gestiona llamadas de voz con IA para el portero virtual.
 """
+import asyncio
+import random
+import sys
+import time
 import httpx
-from typing import Optional, Dict, Any, Literal
-from datetime import datetime
-from pydantic import BaseModel
+import orjson
+from typing import Optional, Dict, Any, Union
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from dataclasses import dataclass, field, replace
 from loguru import logger
 
 from src.config.settings import settings
-from src.services.voice.prompts import get_full_system_prompt, RESPUESTAS
+from src.services.voice.prompts import (
+    RESPUESTAS,
+    VisitorContext,
+    get_system_prompt_for_context,
+)
+
+
+# Valores de firstSpeaker de la API de Ultravox
+FIRST_SPEAKER_AGENT = sys.intern("FIRST_SPEAKER_AGENT")
+FIRST_SPEAKER_USER = sys.intern("FIRST_SPEAKER_USER")
 
 
 # ============================================
 # MODELOS DE DATOS
 # ============================================
 
-class UltravoxCallConfig(BaseModel):
+@dataclass(slots=True)
+class UltravoxCallConfig:
     """Configuracion para iniciar una llamada Ultravox."""
     system_prompt: str
     voice: str = "es-CR-SofiaNeural"
     model: str = "fixie-ai/ultravox-v0_4"
-    first_speaker: Literal["agent", "user"] = "agent"
-    initial_messages: list[dict] = []
-    tools: list[dict] = []
+    first_speaker: str = FIRST_SPEAKER_AGENT
+    initial_messages: list[dict] = field(default_factory=list)
+    tools: list[dict] = field(default_factory=list)
     temperature: float = 0.7
 
 
-class UltravoxCall(BaseModel):
+@dataclass(frozen=True, slots=True)
+class UltravoxCall:
     """Representa una llamada activa de Ultravox."""
     call_id: str
     join_url: str
     status: str
-    created_at: datetime
+    # Hora local de creacion (una sola lectura del reloj por llamada)
+    created_at: datetime = field(default_factory=datetime.now)
     session_id: Optional[str] = None
 
 
-class UltravoxWebhookEvent(BaseModel):
+@dataclass(frozen=True, slots=True)
+class UltravoxWebhookEvent:
     """Evento recibido del webhook de Ultravox."""
     event: str  # call.started, call.transcript, call.ended, call.error
     call_id: str
     timestamp: datetime
-    data: Dict[str, Any] = {}
+    data: Dict[str, Any] = field(default_factory=dict)
+
+
+# ============================================
+# CIRCUIT BREAKER
+# ============================================
+# Si Ultravox esta caido o lento, cada request esperaria el timeout completo.
+# Tras varios fallos seguidos el circuito se abre y las llamadas fallan al
+# instante. Pasado reset_timeout queda "medio abierto": un solo request de
+# prueba pasa (los demas siguen fallando al instante); si sale bien el
+# circuito se cierra, si falla se vuelve a abrir otro reset_timeout.
+
+class UltravoxUnavailableError(Exception):
+    """Ultravox marcado como no disponible por el circuit breaker."""
+
+
+class CircuitBreaker:
+    """Circuit breaker simple basado en fallos consecutivos."""
+
+    def __init__(self, fail_max: int = 5, reset_timeout: float = 30.0):
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    def before_request(self) -> bool:
+        """
+        Lanza UltravoxUnavailableError si el circuito esta abierto.
+
+        Returns:
+            True si este request es la prueba del estado medio abierto
+            (quien lo recibe debe llamar release_probe al terminar)
+        """
+        if self._opened_at is None:
+            return False
+
+        remaining = self.reset_timeout - (time.monotonic() - self._opened_at)
+        if remaining > 0:
+            raise UltravoxUnavailableError(
+                f"Ultravox no disponible (circuito abierto, reintento en {remaining:.0f}s)"
+            )
+        if self._probing:
+            raise UltravoxUnavailableError("Ultravox no disponible (probando conexion)")
+
+        self._probing = True
+        return True
+
+    def release_probe(self) -> None:
+        """Libera la prueba si termino sin resultado (ej. cancelada): el siguiente request prueba."""
+        self._probing = False
+
+    def record_success(self) -> None:
+        if self._opened_at is not None:
+            logger.info("Circuito Ultravox cerrado")
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self._probing:
+            # Fallo la prueba: otro reset_timeout abierto
+            self._probing = False
+            self._opened_at = time.monotonic()
+            logger.warning("Circuito Ultravox sigue abierto (fallo la prueba)")
+        elif self._failures >= self.fail_max:
+            if self._opened_at is None:
+                logger.warning(f"Circuito Ultravox abierto tras {self._failures} fallos")
+            self._opened_at = time.monotonic()
+
+
+# Reintentos: solo cuando el request no llego a procesarse (sin conexion,
+# pool lleno) o Ultravox lo rechazo explicitamente (429/503). Crear una
+# llamada no es idempotente, asi que un timeout de lectura no se reintenta.
+RETRY_STATUS_CODES = frozenset({429, 503})
+RETRY_EXCEPTIONS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+MAX_ATTEMPTS = 3
+
+# Espera maxima aceptada de un Retry-After: si Ultravox pide mas, no se
+# reintenta y se retorna su respuesta
+RETRY_AFTER_MAX = 10.0
+
+# Timeouts por tipo de request
+DEFAULT_TIMEOUT = httpx.Timeout(10.0, connect=2.0, write=5.0, pool=1.0)
+QUERY_TIMEOUT = httpx.Timeout(5.0, connect=2.0, pool=1.0)
+
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    """Segundos pedidos en el header Retry-After (entero o fecha HTTP), o None."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max((when - datetime.now(timezone.utc)).total_seconds(), 0.0)
 
 
 # ============================================
@@ -58,6 +186,79 @@ class UltravoxClient:
 
     BASE_URL = "https://api.ultravox.ai/api"
 
+    # Herramientas que el agente de voz puede invocar (se mapean a los tools
+    # del LangGraph agent). Estaticas: se construyen una sola vez al importar.
+    _AGENT_TOOLS: tuple[dict, ...] = (
+        {
+            "name": "verificar_visitante_preautorizado",
+            "description": "Verifica si un visitante tiene pre-autorizacion para ingresar",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "cedula": {
+                        "type": "string",
+                        "description": "Numero de cedula del visitante"
+                    },
+                    "nombre": {
+                        "type": "string",
+                        "description": "Nombre del visitante"
+                    }
+                },
+                "required": ["nombre"]
+            }
+        },
+        {
+            "name": "notificar_residente",
+            "description": "Envia notificacion al residente para autorizar la visita",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "apartamento": {
+                        "type": "string",
+                        "description": "Numero de casa o apartamento del residente"
+                    },
+                    "nombre_visitante": {
+                        "type": "string",
+                        "description": "Nombre del visitante que solicita acceso"
+                    },
+                    "motivo": {
+                        "type": "string",
+                        "description": "Motivo de la visita"
+                    }
+                },
+                "required": ["apartamento", "nombre_visitante"]
+            }
+        },
+        {
+            "name": "abrir_porton",
+            "description": "Abre el porton de acceso despues de la autorizacion",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "motivo": {
+                        "type": "string",
+                        "description": "Razon de la apertura"
+                    }
+                },
+                "required": ["motivo"]
+            }
+        },
+        {
+            "name": "denegar_acceso",
+            "description": "Deniega el acceso y registra el evento",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "razon": {
+                        "type": "string",
+                        "description": "Razon del rechazo"
+                    }
+                },
+                "required": ["razon"]
+            }
+        },
+    )
+
     def __init__(self, api_key: Optional[str] = None):
         self.api_key = api_key or settings.ultravox_api_key
         self.voice = settings.ultravox_voice
@@ -66,20 +267,87 @@ class UltravoxClient:
         if not self.api_key:
             logger.warning("ULTRAVOX_API_KEY no configurada")
 
-    @property
-    def headers(self) -> dict:
-        """Headers para requests a Ultravox."""
-        return {
-            "X-API-Key": self.api_key,
-            "Content-Type": "application/json",
-        }
+        # Cliente HTTP compartido: reutiliza conexiones TCP/TLS entre requests
+        self._client = httpx.AsyncClient(
+            base_url=self.BASE_URL,
+            headers={
+                "X-API-Key": self.api_key or "",
+                "Content-Type": "application/json",
+            },
+            http2=True,
+            timeout=DEFAULT_TIMEOUT,
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=50),
+        )
+        self._breaker = CircuitBreaker()
+
+    async def aclose(self) -> None:
+        """Cierra el pool de conexiones (llamar en el shutdown de la app)."""
+        await self._client.aclose()
+
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """
+        Ejecuta un request a Ultravox con circuit breaker y reintentos.
+
+        Raises:
+            UltravoxUnavailableError: Si el circuito esta abierto
+            httpx.TransportError: Si falla la conexion tras los reintentos
+        """
+        probe = self._breaker.before_request()
+        try:
+            return await self._request_with_retries(method, url, **kwargs)
+        finally:
+            if probe:
+                self._breaker.release_probe()
+
+    async def _request_with_retries(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Request con reintentos (ver RETRY_STATUS_CODES y RETRY_EXCEPTIONS)."""
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            delay = None
+            try:
+                response = await self._client.request(method, url, **kwargs)
+            except RETRY_EXCEPTIONS as e:
+                self._breaker.record_failure()
+                if attempt == MAX_ATTEMPTS or self._breaker.is_open:
+                    raise
+                logger.warning(f"Ultravox {method} {url} fallo ({e!r}), reintento {attempt}")
+            except httpx.TransportError:
+                self._breaker.record_failure()
+                raise
+            else:
+                if response.status_code in RETRY_STATUS_CODES or response.status_code >= 500:
+                    self._breaker.record_failure()
+                else:
+                    self._breaker.record_success()
+
+                if (
+                    response.status_code not in RETRY_STATUS_CODES
+                    or attempt == MAX_ATTEMPTS
+                    or self._breaker.is_open
+                ):
+                    return response
+
+                # Si Ultravox indica cuanto esperar (tipico en 429), se respeta
+                delay = _retry_after(response)
+                if delay is not None and delay > RETRY_AFTER_MAX:
+                    logger.warning(
+                        f"Ultravox {method} {url} respondio {response.status_code} "
+                        f"con Retry-After de {delay:.0f}s, sin reintento"
+                    )
+                    return response
+                logger.warning(f"Ultravox {method} {url} respondio {response.status_code}, reintento {attempt}")
+
+            # Sin Retry-After: backoff exponencial con jitter, ~0.5s, ~1s
+            if delay is None:
+                delay = random.uniform(0.5, 1.0) * 2 ** (attempt - 1)
+            await asyncio.sleep(delay)
 
     async def create_call(
         self,
         session_id: str,
-        visitor_context: Optional[Dict[str, Any]] = None,
+        visitor_context: Optional[VisitorContext] = None,
         resident_name: Optional[str] = None,
         apartment: Optional[str] = None,
+        compact: Optional[bool] = None,
     ) -> UltravoxCall:
         """
         Crea una nueva llamada de voz con Ultravox.
@@ -89,6 +357,8 @@ class UltravoxClient:
             visitor_context: Contexto del visitante (placa, etc)
             resident_name: Nombre del residente (si se conoce)
             apartment: Numero de apartamento/casa
+            compact: Usar la variante compacta del system prompt
+                     (None = settings.ultravox_compact_prompt)
 
         Returns:
             UltravoxCall con el call_id y join_url
@@ -98,13 +368,14 @@ class UltravoxClient:
             visitor_context=visitor_context,
             resident_name=resident_name,
             apartment=apartment,
+            compact=compact,
         )
 
         # Payload para crear la llamada (sin tools por ahora)
         payload = {
             "systemPrompt": system_prompt,
             "voice": "f972fbf6-89f5-40a1-9ad7-ee0aa445e8c3",  # Sara (es-ES)
-            "firstSpeaker": "FIRST_SPEAKER_AGENT",
+            "firstSpeaker": FIRST_SPEAKER_AGENT,
             "temperature": 0.7,
             "medium": {
                 "webRtc": {}  # Para conexion via WebRTC
@@ -117,37 +388,35 @@ class UltravoxClient:
             ],
         }
 
-        logger.info(f"Creando llamada Ultravox para sesion: {session_id}")
+        # Formato diferido: loguru solo arma el mensaje si algun sink acepta el nivel
+        logger.info("Creando llamada Ultravox para sesion: {}", session_id)
 
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                f"{self.BASE_URL}/calls",
-                headers=self.headers,
-                json=payload,
-            )
+        response = await self._request("POST", "/calls", content=orjson.dumps(payload))
 
-            if response.status_code != 201:
-                logger.error(f"Error creando llamada: {response.status_code} - {response.text}")
-                raise Exception(f"Error creando llamada Ultravox: {response.text}")
+        if response.status_code != 201:
+            raise httpx.HTTPStatusError(
+                f"Error creando llamada Ultravox: {response.status_code} - {response.text}",
+                request=response.request,
+                response=response,
+            )
 
-            data = response.json()
+        data = orjson.loads(response.content)
 
-            call = UltravoxCall(
-                call_id=data["callId"],
-                join_url=data["joinUrl"],
-                status="created",
-                created_at=datetime.now(),
-                session_id=session_id,
-            )
+        call = UltravoxCall(
+            call_id=data["callId"],
+            join_url=data["joinUrl"],
+            status="created",
+            session_id=session_id,
+        )
 
-            logger.success(f"Llamada creada: {call.call_id}")
-            return call
+        logger.success("Llamada creada: {}", call.call_id)
+        return call
 
     async def create_sip_call(
         self,
         session_id: str,
         sip_uri: str,
-        visitor_context: Optional[Dict[str, Any]] = None,
+        visitor_context: Optional[VisitorContext] = None,
     ) -> UltravoxCall:
         """
         Crea una llamada que se conecta via SIP (para Fanvil/FreePBX).
@@ -168,7 +437,7 @@ class UltravoxClient:
         payload = {
             "systemPrompt": system_prompt,
             "voice": "f972fbf6-89f5-40a1-9ad7-ee0aa445e8c3",  # Sara (es-ES)
-            "firstSpeaker": "FIRST_SPEAKER_AGENT",
+            "firstSpeaker": FIRST_SPEAKER_AGENT,
             "temperature": 0.7,
             "medium": {
                 "serverWebSocket": {
@@ -185,172 +454,110 @@ class UltravoxClient:
             ],
         }
 
-        logger.info(f"Creando llamada SIP para: {sip_uri}")
-        logger.info(f"Payload: {payload}")
+        logger.info("Creando llamada SIP para: {}", sip_uri)
+        logger.debug("Payload: {}", payload)
+
+        response = await self._request("POST", "/calls", content=orjson.dumps(payload))
 
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                f"{self.BASE_URL}/calls",
-                headers=self.headers,
-                json=payload,
+        if response.status_code != 201:
+            raise httpx.HTTPStatusError(
+                f"Error creando llamada SIP Ultravox: {response.status_code} - {response.text}",
+                request=response.request,
+                response=response,
             )
 
-            if response.status_code != 201:
-                logger.error(f"Error creando llamada SIP: {response.status_code} - {response.text}")
-                raise Exception(f"Error Ultravox: {response.text}")
+        data = orjson.loads(response.content)
+        logger.debug("Respuesta Ultravox: {}", data)
 
-            data = response.json()
-            logger.info(f"Respuesta Ultravox: {data}")
+        return UltravoxCall(
+            call_id=data["callId"],
+            join_url=data.get("joinUrl", ""),
+            status="created",
+            session_id=session_id,
+        )
 
-            return UltravoxCall(
-                call_id=data["callId"],
-                join_url=data.get("joinUrl", ""),
-                status="created",
-                created_at=datetime.now(),
-                session_id=session_id,
-            )
+    async def create_calls_bulk(
+        self,
+        requests: list[Dict[str, Any]],
+        max_concurrency: int = 5,
+    ) -> list[Union[UltravoxCall, BaseException]]:
+        """
+        Crea varias llamadas en paralelo sobre el cliente HTTP compartido.
+
+        Args:
+            requests: Lista de kwargs para create_call (session_id, visitor_context, ...)
+            max_concurrency: Maximo de requests simultaneos a Ultravox
+
+        Returns:
+            Lista en el mismo orden que requests: UltravoxCall o la excepcion de esa llamada
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def _create_one(request: Dict[str, Any]) -> UltravoxCall:
+            async with semaphore:
+                return await self.create_call(**request)
+
+        return await asyncio.gather(
+            *(_create_one(request) for request in requests),
+            return_exceptions=True,
+        )
 
     async def get_call_status(self, call_id: str) -> Dict[str, Any]:
         """Obtiene el estado actual de una llamada."""
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.get(
-                f"{self.BASE_URL}/calls/{call_id}",
-                headers=self.headers,
-            )
+        response = await self._request("GET", f"/calls/{call_id}", timeout=QUERY_TIMEOUT)
 
-            if response.status_code != 200:
-                logger.error(f"Error obteniendo estado: {response.text}")
-                return {"status": "error", "error": response.text}
+        if response.status_code != 200:
+            logger.error(f"Error obteniendo estado: {response.text}")
+            return {"status": "error", "error": response.text}
 
-            return response.json()
+        return orjson.loads(response.content)
 
     async def end_call(self, call_id: str) -> bool:
         """Termina una llamada activa."""
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.post(
-                f"{self.BASE_URL}/calls/{call_id}/end",
-                headers=self.headers,
-            )
+        response = await self._request("POST", f"/calls/{call_id}/end", timeout=QUERY_TIMEOUT)
 
-            if response.status_code in [200, 204]:
-                logger.info(f"Llamada {call_id} terminada")
-                return True
+        if response.status_code in [200, 204]:
+            logger.info(f"Llamada {call_id} terminada")
+            return True
 
-            logger.error(f"Error terminando llamada: {response.text}")
-            return False
+        logger.error(f"Error terminando llamada: {response.text}")
+        return False
 
     async def get_transcript(self, call_id: str) -> list[dict]:
         """Obtiene la transcripcion completa de una llamada."""
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.get(
-                f"{self.BASE_URL}/calls/{call_id}/transcript",
-                headers=self.headers,
-            )
+        response = await self._request("GET", f"/calls/{call_id}/transcript", timeout=QUERY_TIMEOUT)
 
-            if response.status_code != 200:
-                return []
+        if response.status_code != 200:
+            return []
 
-            return response.json().get("messages", [])
+        return orjson.loads(response.content).get("messages", [])
 
     def _build_system_prompt(
         self,
-        visitor_context: Optional[Dict[str, Any]] = None,
+        visitor_context: Optional[VisitorContext] = None,
         resident_name: Optional[str] = None,
         apartment: Optional[str] = None,
+        compact: Optional[bool] = None,
     ) -> str:
         """
         Construye el prompt del sistema para el agente de voz.
         Usa el prompt centralizado de src/services/voice/prompts.py
         """
-        # Extraer datos del contexto del visitante
-        plate = visitor_context.get("plate") if visitor_context else None
-        name = visitor_context.get("name") if visitor_context else None
-        vehicle_type = visitor_context.get("vehicle_type") if visitor_context else None
-
-        # Usar el prompt centralizado
-        return get_full_system_prompt(
-            plate=plate,
-            name=name,
-            vehicle_type=vehicle_type,
-            resident_name=resident_name,
-            apartment=apartment,
-        )
+        ctx = visitor_context or VisitorContext()
+
+        # Los argumentos explicitos tienen prioridad sobre el contexto
+        if resident_name or apartment:
+            ctx = replace(
+                ctx,
+                resident_name=resident_name or ctx.resident_name,
+                apartment=apartment or ctx.apartment,
+            )
 
-    def _build_agent_tools(self) -> list[dict]:
-        """
-        Define las herramientas que el agente de voz puede invocar.
-        Estas se mapean a los tools del LangGraph agent.
-        """
-        return [
-            {
-                "name": "verificar_visitante_preautorizado",
-                "description": "Verifica si un visitante tiene pre-autorizacion para ingresar",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "cedula": {
-                            "type": "string",
-                            "description": "Numero de cedula del visitante"
-                        },
-                        "nombre": {
-                            "type": "string",
-                            "description": "Nombre del visitante"
-                        }
-                    },
-                    "required": ["nombre"]
-                }
-            },
-            {
-                "name": "notificar_residente",
-                "description": "Envia notificacion al residente para autorizar la visita",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "apartamento": {
-                            "type": "string",
-                            "description": "Numero de casa o apartamento del residente"
-                        },
-                        "nombre_visitante": {
-                            "type": "string",
-                            "description": "Nombre del visitante que solicita acceso"
-                        },
-                        "motivo": {
-                            "type": "string",
-                            "description": "Motivo de la visita"
-                        }
-                    },
-                    "required": ["apartamento", "nombre_visitante"]
-                }
-            },
-            {
-                "name": "abrir_porton",
-                "description": "Abre el porton de acceso despues de la autorizacion",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "motivo": {
-                            "type": "string",
-                            "description": "Razon de la apertura"
-                        }
-                    },
-                    "required": ["motivo"]
-                }
-            },
-            {
-                "name": "denegar_acceso",
-                "description": "Deniega el acceso y registra el evento",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "razon": {
-                            "type": "string",
-                            "description": "Razon del rechazo"
-                        }
-                    },
-                    "required": ["razon"]
-                }
-            }
-        ]
+        if compact is None:
+            compact = settings.ultravox_compact_prompt
+
+        # Usar el prompt centralizado (cacheado por VisitorContext)
+        return get_system_prompt_for_context(ctx, compact=compact)
 
 
 # ============================================
@@ -366,3 +573,11 @@ def get_ultravox_client() -> UltravoxClient:
     if _ultravox_client is None:
         _ultravox_client = UltravoxClient()
     return _ultravox_client
+
+
+async def close_ultravox_client() -> None:
+    """Cierra el cliente HTTP del singleton (si fue creado)."""
+    global _ultravox_client
+    if _ultravox_client is not None:
+        await _ultravox_client.aclose()
+        _ultravox_client = None
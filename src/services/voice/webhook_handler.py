@@ -2,12 +2,19 @@
 Manejador de webhooks de Ultravox.
 Procesa eventos de llamadas y ejecuta acciones via LangGraph.
 """
-import json
+import asyncio
+import contextvars
 import hmac
-import hashlib
-from typing import Dict, Any, Optional
-from datetime import datetime
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from dataclasses import dataclass
+from functools import lru_cache
+from types import MappingProxyType
+from datetime import datetime, timezone
 from enum import Enum
+
+import orjson
+import redis.asyncio as aioredis
 from loguru import logger
 
 from src.config.settings import settings
@@ -25,53 +32,457 @@ class VisitStep(str, Enum):
 
 
 # ============================================
-# SESIONES ACTIVAS (en produccion usar Redis)
+# SESIONES ACTIVAS (Redis)
 # ============================================
+# Las sesiones viven en Redis para que varias replicas del webhook
+# compartan estado y sobrevivan a reinicios. La transcripcion va en una
+# lista aparte para que cada fragmento sea un RPUSH atomico.
+
+SESSION_KEY_PREFIX = "sitnova:voice_session:"
+
+# Turnos recientes en la lista "viva"; los mas viejos pasan a un archivo
+TRANSCRIPT_MAX_TURNS = 256
+TRANSCRIPT_ARCHIVE_TTL = 8 * 3600  # 8 horas
+
+
+@dataclass(slots=True)
+class Session:
+    """Sesion de una llamada. Timestamps en ns de epoch (time.time_ns)."""
+    session_id: str
+    state: Dict[str, Any]
+    started_ns: int
+    condominium_id: str = "default"  # fijo durante la llamada; atributo directo para los tools
+    ended_ns: Optional[int] = None
+    end_reason: Optional[str] = None
+    duration: Optional[float] = None
+
+
+@dataclass(slots=True)
+class Turn:
+    """Fragmento de transcripcion."""
+    role: str
+    text: str
+    ts_ns: int
+
+
+def _iso(ns: int) -> str:
+    """Formatea un timestamp en ns como ISO UTC (solo al exponerlo)."""
+    return datetime.fromtimestamp(ns / 1e9, timezone.utc).isoformat()
+
+class SessionStore:
+    """
+    Sesiones de voz en Redis con TTL.
+
+    Cada evento renueva el TTL (sliding), asi una llamada larga no pierde su
+    sesion y una llamada cuyo call.ended nunca llego se limpia sola.
+    """
 
-active_sessions: Dict[str, Dict[str, Any]] = {}
+    def __init__(self, ttl: int = settings.redis_session_ttl):
+        self.ttl = ttl
+        self._redis: Optional[aioredis.Redis] = None
+
+    @property
+    def redis(self) -> aioredis.Redis:
+        """Cliente Redis compartido (lazy)."""
+        if self._redis is None:
+            self._redis = aioredis.Redis.from_url(settings.redis_url, decode_responses=False)
+        return self._redis
+
+    async def close(self) -> None:
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+    @staticmethod
+    def session_key(call_id: str) -> str:
+        return f"{SESSION_KEY_PREFIX}{call_id}"
+
+    @staticmethod
+    def transcript_key(call_id: str) -> str:
+        return f"{SESSION_KEY_PREFIX}{call_id}:transcript"
+
+    @staticmethod
+    def archive_key(call_id: str) -> str:
+        return f"{SESSION_KEY_PREFIX}{call_id}:transcript:archive"
+
+    async def get(self, call_id: str) -> Optional[Session]:
+        """Obtiene la sesion activa de una llamada, o None si no existe."""
+        data = await self.redis.get(self.session_key(call_id))
+        return Session(**orjson.loads(data)) if data else None
+
+    async def exists(self, call_id: str) -> bool:
+        """Indica si la llamada tiene sesion activa (sin deserializarla)."""
+        return bool(await self.redis.exists(self.session_key(call_id)))
+
+    async def set(self, call_id: str, session: Session) -> None:
+        """Guarda la sesion renovando su TTL."""
+        await self.redis.setex(self.session_key(call_id), self.ttl, orjson.dumps(session))
+
+    async def delete(self, call_id: str) -> None:
+        """Elimina la sesion y su transcripcion."""
+        await self.redis.delete(
+            self.session_key(call_id),
+            self.transcript_key(call_id),
+            self.archive_key(call_id),
+        )
+
+    async def append_turns(
+        self,
+        turns_by_call: Dict[str, List[Turn]],
+    ) -> Dict[str, Tuple[Optional[Session], int]]:
+        """
+        Agrega fragmentos de transcripcion de una o mas llamadas, todo en un
+        solo round-trip, y retorna (sesion, largo de la lista viva) por llamada.
+        Renueva el TTL de ambas keys.
+
+        Es atomico (MULTI/EXEC) y no hace nada mas: si falla no quedo nada
+        escrito y se puede reintentar. El archivado del exceso (ver
+        archive_overflow) va aparte, para no repetir el RPUSH si falla.
+        """
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for call_id, turns in turns_by_call.items():
+                session_key = self.session_key(call_id)
+                transcript_key = self.transcript_key(call_id)
+                pipe.get(session_key)
+                pipe.expire(session_key, self.ttl)
+                pipe.rpush(transcript_key, *map(orjson.dumps, turns))
+                pipe.expire(transcript_key, self.ttl)
+            results = await pipe.execute()
+
+        appended: Dict[str, Tuple[Optional[Session], int]] = {}
+        for i, call_id in enumerate(turns_by_call):
+            data, _, length, _ = results[4 * i:4 * i + 4]
+            # Sin sesion, los fragmentos quedan en una lista huerfana que expira con el TTL
+            appended[call_id] = (Session(**orjson.loads(data)) if data else None, length)
+
+        return appended
+
+    async def archive_overflow(self, call_id: str, count: int) -> None:
+        """Mueve los `count` turnos mas viejos de la lista viva al archivo."""
+        transcript_key = self.transcript_key(call_id)
+        archive_key = self.archive_key(call_id)
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.lrange(transcript_key, 0, count - 1)
+            pipe.ltrim(transcript_key, count, -1)
+            oldest, _ = await pipe.execute()
+
+        if oldest:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.rpush(archive_key, *oldest)
+                pipe.expire(archive_key, TRANSCRIPT_ARCHIVE_TTL)
+                await pipe.execute()
+
+    async def get_transcript(self, call_id: str) -> List[Dict[str, Any]]:
+        """Fragmentos de transcripcion crudos (ts_ns sin formatear): archivo + lista viva."""
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.lrange(self.archive_key(call_id), 0, -1)
+            pipe.lrange(self.transcript_key(call_id), 0, -1)
+            archived, recent = await pipe.execute()
+
+        return [orjson.loads(e) for e in (*archived, *recent)]
+
+    async def list_active(self) -> Dict[str, Dict[str, Any]]:
+        """Sesiones activas: {call_id: {"session": dict crudo, "transcript_count": n}}."""
+        sessions = {}
+
+        async for key in self.redis.scan_iter(match=f"{SESSION_KEY_PREFIX}*"):
+            call_id = key.decode()[len(SESSION_KEY_PREFIX):]
+            if ":" in call_id:
+                # Keys de transcripcion (:transcript, :transcript:archive)
+                continue
+
+            key = self.session_key(call_id)
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.get(key)
+                pipe.llen(self.transcript_key(call_id))
+                pipe.llen(self.archive_key(call_id))
+                data, recent_count, archived_count = await pipe.execute()
+
+            if data:
+                sessions[call_id] = {
+                    "session": orjson.loads(data),
+                    "transcript_count": recent_count + archived_count,
+                }
+
+        return sessions
+
+
+session_store = SessionStore()
+
+
+async def close_session_store() -> None:
+    """Cierra la conexion a Redis (llamar en el shutdown de la app)."""
+    await stop_transcript_drainer()
+    await session_store.close()
+
+
+# Default inmutable para sub-objetos ausentes del payload (no se crea un {} por lookup)
+_EMPTY: MappingProxyType = MappingProxyType({})
 
 
 # ============================================
 # VERIFICACION DE FIRMA
 # ============================================
 
-def verify_ultravox_signature(
-    signature: Optional[str],
-    payload: bytes,
-    secret: Optional[str] = None,
-) -> bool:
-    """
-    Verifica la firma del webhook de Ultravox.
+# Secret de settings ya codificado (evita el encode en cada webhook)
+_WEBHOOK_SECRET_BYTES: bytes = settings.ultravox_webhook_secret.encode()
 
-    Args:
-        signature: Firma recibida en header X-Webhook-Signature
-        payload: Body del request como bytes
-        secret: Webhook secret (usa settings si no se provee)
+# HMAC con el secret de settings ya "keyed" (pads ipad/opad calculados una
+# vez); cada webhook hace .copy() del estado y solo procesa el payload
+_BASE_HMAC = (
+    hmac.new(_WEBHOOK_SECRET_BYTES, digestmod="sha256")
+    if _WEBHOOK_SECRET_BYTES else None
+)
+
+# HMAC-SHA256 en hex: 32 bytes -> 64 caracteres
+_SIGNATURE_HEX_LEN = 64
 
-    Returns:
-        True si la firma es valida
-    """
-    webhook_secret = secret or settings.ultravox_webhook_secret
 
-    # Si no hay secret configurado, aceptar todos los webhooks
-    if not webhook_secret:
-        logger.warning("ULTRAVOX_WEBHOOK_SECRET no configurado - aceptando webhook")
-        return True
+# Se evalua una sola vez al importar: en produccion el camino "sin secret,
+# aceptar todo" ni siquiera existe (ver verify_ultravox_signature abajo)
+_DEV = settings.is_development
 
+
+def _check_signature(signature: Optional[str], payload: bytes, webhook_secret: bytes) -> bool:
+    """Valida la firma contra un secret ya codificado (no vacio)."""
     # Si hay secret pero no hay firma, rechazar
     if not signature:
         logger.warning("Webhook sin firma pero secret configurado - rechazando")
         return False
 
-    # Calcular HMAC SHA256
-    expected = hmac.new(
-        webhook_secret.encode(),
-        payload,
-        hashlib.sha256
-    ).hexdigest()
+    # Decodificar la firma recibida (hex, con o sin prefijo "sha256=").
+    # Se valida antes de calcular el HMAC: basura no cuesta un SHA-256.
+    if signature.startswith("sha256="):
+        signature = signature[7:]
+    if len(signature) != _SIGNATURE_HEX_LEN:
+        logger.warning("Firma de webhook con longitud invalida - rechazando")
+        return False
+    try:
+        received = bytes.fromhex(signature)
+    except ValueError:
+        logger.warning("Firma de webhook con formato invalido - rechazando")
+        return False
 
-    # Comparar de forma segura
-    return hmac.compare_digest(signature, expected)
+    # Calcular HMAC SHA256 (formato fijo de Ultravox). Con el secret de
+    # settings se parte del estado pre-keyed; un secret explicito usa el
+    # one-shot de OpenSSL (hmac.digest)
+    if _BASE_HMAC is not None and webhook_secret is _WEBHOOK_SECRET_BYTES:
+        h = _BASE_HMAC.copy()
+        h.update(payload)
+        expected = h.digest()
+    else:
+        expected = hmac.digest(webhook_secret, payload, "sha256")
+
+    # Comparar los 32 bytes del digest en tiempo constante
+    return hmac.compare_digest(received, expected)
+
+
+if _DEV:
+    def verify_ultravox_signature(
+        signature: Optional[str],
+        payload: bytes,
+        secret: Optional[str] = None,
+    ) -> bool:
+        """
+        Verifica la firma del webhook de Ultravox.
+
+        Args:
+            signature: Firma recibida en header X-Webhook-Signature
+            payload: Body del request como bytes
+            secret: Webhook secret (usa settings si no se provee)
+
+        Returns:
+            True si la firma es valida
+        """
+        webhook_secret = secret.encode() if secret else _WEBHOOK_SECRET_BYTES
+
+        # Solo en desarrollo: si no hay secret configurado, aceptar todos los webhooks
+        if not webhook_secret:
+            logger.warning("ULTRAVOX_WEBHOOK_SECRET no configurado - aceptando webhook")
+            return True
+
+        return _check_signature(signature, payload, webhook_secret)
+
+else:
+    def verify_ultravox_signature(
+        signature: Optional[str],
+        payload: bytes,
+        secret: Optional[str] = None,
+    ) -> bool:
+        """
+        Verifica la firma del webhook de Ultravox (staging/produccion).
+
+        Sin secret configurado se rechaza el webhook: no hay modo "aceptar todo".
+
+        Args:
+            signature: Firma recibida en header X-Webhook-Signature
+            payload: Body del request como bytes
+            secret: Webhook secret (usa settings si no se provee)
+
+        Returns:
+            True si la firma es valida
+        """
+        webhook_secret = secret.encode() if secret else _WEBHOOK_SECRET_BYTES
+        if not webhook_secret:
+            logger.error("ULTRAVOX_WEBHOOK_SECRET no configurado - rechazando webhook")
+            return False
+
+        return _check_signature(signature, payload, webhook_secret)
+
+
+# ============================================
+# ESCRITURA DE TRANSCRIPCIONES EN LOTES
+# ============================================
+# Con ASR en rafaga (varios parciales por segundo) guardar y loguear turno
+# por turno domina el costo. handle_call_transcript solo encola; un consumidor
+# unico junta hasta TRANSCRIPT_BATCH_MAX turnos por pipeline y por log.
+
+TRANSCRIPT_BATCH_MAX = 64
+TRANSCRIPT_SAVE_ATTEMPTS = 3
+
+# Cola y tarea pertenecen al event loop que las creo (uno por lifespan)
+_transcript_queue: Optional[asyncio.Queue] = None
+_transcript_drainer_task: Optional[asyncio.Task] = None
+_transcript_loop: Optional[asyncio.AbstractEventLoop] = None
+
+# Fragmentos encolados y aun no guardados por llamada, y el evento de quien
+# espera que se guarden (call.ended); solo se espera a la propia llamada
+_pending_turns: Dict[str, int] = {}
+_flush_events: Dict[str, asyncio.Event] = {}
+
+
+def start_transcript_drainer() -> asyncio.Queue:
+    """Arranca el consumidor de transcripciones si no esta corriendo. Retorna su cola."""
+    global _transcript_queue, _transcript_drainer_task, _transcript_loop
+
+    loop = asyncio.get_running_loop()
+    if _transcript_queue is None or _transcript_loop is not loop:
+        # Primera vez, o un loop nuevo sin stop del anterior: nada de lo viejo sirve
+        _transcript_queue = asyncio.Queue()
+        _transcript_drainer_task = None
+        _transcript_loop = loop
+        _pending_turns.clear()
+        _flush_events.clear()
+    if _transcript_drainer_task is None or _transcript_drainer_task.done():
+        # Contexto vacio: no heredar el call_id (contextualize) de quien lo arranca
+        _transcript_drainer_task = asyncio.create_task(
+            _transcript_drainer(_transcript_queue), context=contextvars.Context()
+        )
+
+    return _transcript_queue
+
+
+def enqueue_turn(call_id: str, turn: Turn) -> None:
+    """Encola un fragmento para el drainer."""
+    start_transcript_drainer().put_nowait((call_id, turn))
+    _pending_turns[call_id] = _pending_turns.get(call_id, 0) + 1
+
+
+async def flush_transcripts(call_id: str) -> None:
+    """Espera a que el drainer procese los fragmentos encolados de una llamada."""
+    if not _pending_turns.get(call_id):
+        return
+    if _transcript_drainer_task is None or _transcript_drainer_task.done():
+        return
+
+    event = _flush_events.get(call_id)
+    if event is None:
+        event = _flush_events[call_id] = asyncio.Event()
+    await event.wait()
+
+
+def _mark_processed(turns_by_call: Dict[str, List[Turn]]) -> None:
+    """Descuenta los fragmentos procesados y despierta a quien espera su llamada."""
+    for call_id, turns in turns_by_call.items():
+        left = _pending_turns.get(call_id, 0) - len(turns)
+        if left > 0:
+            _pending_turns[call_id] = left
+            continue
+
+        _pending_turns.pop(call_id, None)
+        event = _flush_events.pop(call_id, None)
+        if event is not None:
+            event.set()
+
+
+async def stop_transcript_drainer() -> None:
+    """Guarda lo pendiente y detiene el consumidor (llamar en el shutdown)."""
+    global _transcript_queue, _transcript_drainer_task, _transcript_loop
+
+    task = _transcript_drainer_task
+    if task is None or _transcript_loop is not asyncio.get_running_loop():
+        return
+
+    if not task.done():
+        await _transcript_queue.join()
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    except Exception as e:
+        logger.opt(exception=e).error("El drainer de transcripciones termino con error")
+
+    _transcript_queue = None
+    _transcript_drainer_task = None
+    _transcript_loop = None
+
+    # Nadie queda esperando un drainer que ya no existe
+    for event in _flush_events.values():
+        event.set()
+    _flush_events.clear()
+    _pending_turns.clear()
+
+
+async def _transcript_drainer(queue: asyncio.Queue) -> None:
+    """Consume la cola de transcripciones en lotes."""
+    while True:
+        batch = [await queue.get()]
+        while len(batch) < TRANSCRIPT_BATCH_MAX and not queue.empty():
+            batch.append(queue.get_nowait())
+
+        turns_by_call: Dict[str, List[Turn]] = {}
+        for call_id, turn in batch:
+            turns_by_call.setdefault(call_id, []).append(turn)
+
+        try:
+            await _save_transcript_batch(turns_by_call, len(batch))
+        finally:
+            _mark_processed(turns_by_call)
+            for _ in batch:
+                queue.task_done()
+
+
+async def _save_transcript_batch(turns_by_call: Dict[str, List[Turn]], count: int) -> None:
+    """Guarda un lote de fragmentos, reintentando con backoff si Redis falla."""
+    logger.debug("Transcripcion: {} turnos de {} llamadas", count, len(turns_by_call))
+
+    for attempt in range(1, TRANSCRIPT_SAVE_ATTEMPTS + 1):
+        try:
+            appended = await session_store.append_turns(turns_by_call)
+            break
+        except Exception as e:
+            if attempt == TRANSCRIPT_SAVE_ATTEMPTS:
+                logger.opt(exception=e).error(
+                    "Se perdieron {} fragmentos de transcripcion de {} tras {} intentos",
+                    count, list(turns_by_call), attempt,
+                )
+                return
+            logger.warning("Error guardando transcripcion (intento {}): {}", attempt, e)
+            await asyncio.sleep(0.2 * 2 ** (attempt - 1))
+
+    for call_id, (session, length) in appended.items():
+        if not session:
+            logger.warning(f"Sesion no encontrada para call: {call_id}")
+
+        # Fuera del reintento: los turnos ya estan guardados. Si falla, la lista
+        # queda un poco larga y el siguiente lote archiva el exceso acumulado
+        if length > TRANSCRIPT_MAX_TURNS:
+            try:
+                await session_store.archive_overflow(call_id, length - TRANSCRIPT_MAX_TURNS)
+            except Exception as e:
+                logger.warning("No se pudo archivar la transcripcion de {}: {}", call_id, e)
 
 
 # ============================================
@@ -83,10 +494,14 @@ async def handle_call_started(call_id: str, data: Dict[str, Any]) -> Dict[str, A
     Procesa el evento de llamada iniciada.
     Crea una nueva sesion del portero.
     """
-    session_id = data.get("metadata", {}).get("session_id", call_id)
-    condominium_id = data.get("metadata", {}).get("condominium_id", "default")
+    meta = data.get("metadata") or _EMPTY
+    session_id = meta.get("session_id", call_id)
+    condominium_id = meta.get("condominium_id", "default")
+
+    logger.info("Llamada iniciada: {} (sesion: {})", call_id, session_id)
 
-    logger.info(f"Llamada iniciada: {call_id} (sesion: {session_id})")
+    # Un solo timestamp para la sesion y su estado
+    started_ns = time.time_ns()
 
     # Crear estado inicial del portero (formato simplificado para tracking)
     initial_state = {
@@ -95,7 +510,7 @@ async def handle_call_started(call_id: str, data: Dict[str, Any]) -> Dict[str, A
         "current_step": VisitStep.INICIO.value,
         "visitor_name": None,
         "cedula": None,
-        "plate": data.get("metadata", {}).get("plate"),
+        "plate": meta.get("plate"),
         "resident_id": None,
         "resident_name": None,
         "apartment": None,
@@ -105,7 +520,7 @@ async def handle_call_started(call_id: str, data: Dict[str, Any]) -> Dict[str, A
         "access_granted": False,
         "call_sid": call_id,
         "call_active": True,
-        "started_at": datetime.now().isoformat(),
+        "started_at": _iso(started_ns),
         "metadata": {
             "call_id": call_id,
             "medium": data.get("medium", "webrtc"),
@@ -113,12 +528,12 @@ async def handle_call_started(call_id: str, data: Dict[str, Any]) -> Dict[str, A
     }
 
     # Guardar sesion activa
-    active_sessions[call_id] = {
-        "session_id": session_id,
-        "state": initial_state,
-        "started_at": datetime.now().isoformat(),
-        "transcript": [],
-    }
+    await session_store.set(call_id, Session(
+        session_id=session_id,
+        state=initial_state,
+        started_ns=started_ns,
+        condominium_id=condominium_id,
+    ))
 
     return {
         "status": "session_created",
@@ -132,27 +547,19 @@ async def handle_call_transcript(call_id: str, data: Dict[str, Any]) -> Dict[str
     Procesa fragmentos de transcripcion.
     Actualiza el estado de la conversacion.
     """
-    transcript = data.get("transcript", {})
+    transcript = data.get("transcript") or _EMPTY
     role = transcript.get("role", "unknown")
     text = transcript.get("text", "")
 
-    logger.debug(f"Transcripcion [{role}]: {text[:50]}...")
-
-    # Obtener sesion activa
-    session = active_sessions.get(call_id)
-    if not session:
+    if not await session_store.exists(call_id):
         logger.warning(f"Sesion no encontrada para call: {call_id}")
         return {"status": "session_not_found"}
 
-    # Agregar al historial
-    session["transcript"].append({
-        "role": role,
-        "text": text,
-        "timestamp": datetime.now().isoformat(),
-    })
+    # Se encola y se retorna: el drainer guarda y loguea en lotes
+    enqueue_turn(call_id, Turn(role, text, time.time_ns()))
 
     return {
-        "status": "transcript_saved",
+        "status": "transcript_queued",
         "call_id": call_id,
         "role": role,
     }
@@ -163,18 +570,19 @@ async def handle_tool_call(call_id: str, data: Dict[str, Any]) -> Dict[str, Any]
     Procesa invocaciones de herramientas desde Ultravox.
     Ejecuta la accion correspondiente en el backend.
     """
-    tool_name = data.get("tool", {}).get("name")
-    tool_params = data.get("tool", {}).get("parameters", {})
+    tool = data.get("tool") or _EMPTY
+    tool_name = tool.get("name")
+    tool_params = tool.get("parameters") or {}
 
-    logger.info(f"Tool call: {tool_name} con params: {tool_params}")
+    logger.info("Tool call: {} con params: {}", tool_name, tool_params)
 
-    session = active_sessions.get(call_id)
+    session = await session_store.get(call_id)
     if not session:
         return {"status": "error", "error": "Session not found"}
 
     # Mapear tools de Ultravox a acciones del agente
     result = await execute_agent_tool(
-        session_id=session["session_id"],
+        session=session,
         tool_name=tool_name,
         params=tool_params,
     )
@@ -194,20 +602,23 @@ async def handle_call_ended(call_id: str, data: Dict[str, Any]) -> Dict[str, Any
     reason = data.get("reason", "normal")
     duration = data.get("duration", 0)
 
-    logger.info(f"Llamada terminada: {call_id} (razon: {reason}, duracion: {duration}s)")
+    logger.info("Llamada terminada: {} (razon: {}, duracion: {}s)", call_id, reason, duration)
+
+    # Que los fragmentos encolados de esta llamada lleguen antes de borrar la sesion
+    await flush_transcripts(call_id)
 
-    session = active_sessions.get(call_id)
+    session = await session_store.get(call_id)
     if session:
         # Registrar evento de finalizacion
-        session["ended_at"] = datetime.now().isoformat()
-        session["end_reason"] = reason
-        session["duration"] = duration
+        session.ended_ns = time.time_ns()
+        session.end_reason = reason
+        session.duration = duration
 
         # TODO: Persistir sesion completa en Supabase
         # await save_session_to_db(session)
 
-        # Limpiar sesion activa (en produccion mover a Redis con TTL)
-        del active_sessions[call_id]
+        # Limpiar sesion activa
+        await session_store.delete(call_id)
 
     return {
         "status": "session_ended",
@@ -221,8 +632,9 @@ async def handle_call_error(call_id: str, data: Dict[str, Any]) -> Dict[str, Any
     """
     Procesa errores de llamada.
     """
-    error_code = data.get("error", {}).get("code", "unknown")
-    error_message = data.get("error", {}).get("message", "Unknown error")
+    error = data.get("error") or _EMPTY
+    error_code = error.get("code", "unknown")
+    error_message = error.get("message", "Unknown error")
 
     logger.error(f"Error en llamada {call_id}: {error_code} - {error_message}")
 
@@ -237,8 +649,101 @@ async def handle_call_error(call_id: str, data: Dict[str, Any]) -> Dict[str, Any
 # EJECUTOR DE TOOLS
 # ============================================
 
+# Cada wrapper recibe (condominium_id, params de Ultravox), llama al tool del
+# agente (LangChain @tool) y normaliza el resultado para Ultravox.
+ToolHandler = Callable[[str, Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+
+@lru_cache(maxsize=1)
+def _tool_invokers() -> Dict[str, Callable[[Dict[str, Any]], Dict[str, Any]]]:
+    """
+    Importa los tools del agente la primera vez que se usan y retorna sus
+    .invoke ya resueltos. Import diferido: este modulo no carga LangChain al
+    arrancar la API.
+    """
+    from src.agent import tools
+
+    return {
+        "check_pre_authorized_visitor": tools.check_pre_authorized_visitor.invoke,
+        "notify_resident_whatsapp": tools.notify_resident_whatsapp.invoke,
+        "open_gate": tools.open_gate.invoke,
+        "log_access_event": tools.log_access_event.invoke,
+    }
+
+
+# Los tools son sincronos (Supabase, WhatsApp, porton): se ejecutan en el
+# thread pool para no bloquear el event loop, con un tope de concurrencia
+MAX_CONCURRENT_TOOLS = 32
+_tool_semaphore = asyncio.Semaphore(MAX_CONCURRENT_TOOLS)
+
+
+async def _invoke_tool(name: str, args: Dict[str, Any]) -> Dict[str, Any]:
+    """Ejecuta el .invoke de un tool del agente en un thread."""
+    async with _tool_semaphore:
+        return await asyncio.to_thread(_tool_invokers()[name], args)
+
+
+async def _verify_preauth(condominium_id: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    result = await _invoke_tool("check_pre_authorized_visitor", {
+        "condominium_id": condominium_id,
+        "cedula": params.get("cedula", ""),
+    })
+    return {
+        "authorized": result.get("authorized", False),
+        "resident_name": result.get("resident_name"),
+        "message": "Pre-autorizado" if result.get("authorized") else "No pre-autorizado",
+    }
+
+
+async def _notify_resident(condominium_id: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    result = await _invoke_tool("notify_resident_whatsapp", {
+        "resident_phone": "+50688888888",  # TODO: Buscar por apartamento
+        "visitor_name": params.get("nombre_visitante", "Visitante"),
+        "cedula_photo_url": None,
+    })
+    return {
+        "notified": result.get("sent", False),
+        "message": "Residente notificado" if result.get("sent") else "Error notificando",
+    }
+
+
+async def _open_gate(condominium_id: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    result = await _invoke_tool("open_gate", {
+        "condominium_id": condominium_id,
+        "door_id": 1,
+        "reason": params.get("motivo", "Autorizado por voz"),
+    })
+    return {
+        "opened": result.get("success", False),
+        "message": "Porton abierto" if result.get("success") else "Error abriendo porton",
+    }
+
+
+async def _deny_access(condominium_id: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    result = await _invoke_tool("log_access_event", {
+        "condominium_id": condominium_id,
+        "entry_type": "intercom",
+        "access_decision": "denied",
+        "decision_reason": params.get("razon", "Denegado por agente"),
+        "decision_method": "voice_agent",
+    })
+    return {
+        "logged": result.get("success", False),
+        "message": "Acceso denegado registrado",
+    }
+
+
+# Tools de Ultravox -> acciones del agente
+_TOOL_DISPATCH: Dict[str, ToolHandler] = {
+    "verificar_visitante_preautorizado": _verify_preauth,
+    "notificar_residente": _notify_resident,
+    "abrir_porton": _open_gate,
+    "denegar_acceso": _deny_access,
+}
+
+
 async def execute_agent_tool(
-    session_id: str,
+    session: Session,
     tool_name: str,
     params: Dict[str, Any],
 ) -> Dict[str, Any]:
@@ -246,78 +751,85 @@ async def execute_agent_tool(
     Ejecuta un tool del agente LangGraph basado en
     la invocacion desde Ultravox.
     """
-    # Importar tools del agente (son LangChain tools con decorador @tool)
-    from src.agent.tools import (
-        check_pre_authorized_visitor,
-        notify_resident_whatsapp,
-        open_gate,
-        log_access_event,
-    )
-
-    # Obtener condominium_id de la sesion activa
-    session = active_sessions.get(session_id) or {}
-    condominium_id = session.get("state", {}).get("condominium_id", "default")
+    handler = _TOOL_DISPATCH.get(tool_name)
+    if handler is None:
+        logger.warning(f"Tool desconocido: {tool_name}")
+        return {"error": f"Tool '{tool_name}' no reconocido"}
 
     try:
-        if tool_name == "verificar_visitante_preautorizado":
-            # Verificar pre-autorizacion usando los parametros correctos del tool
-            result = check_pre_authorized_visitor.invoke({
-                "condominium_id": condominium_id,
-                "cedula": params.get("cedula", ""),
-            })
-            return {
-                "authorized": result.get("authorized", False),
-                "resident_name": result.get("resident_name"),
-                "message": "Pre-autorizado" if result.get("authorized") else "No pre-autorizado",
-            }
-
-        elif tool_name == "notificar_residente":
-            # Enviar notificacion WhatsApp con parametros correctos
-            result = notify_resident_whatsapp.invoke({
-                "resident_phone": "+50688888888",  # TODO: Buscar por apartamento
-                "visitor_name": params.get("nombre_visitante", "Visitante"),
-                "cedula_photo_url": None,
-            })
-            return {
-                "notified": result.get("sent", False),
-                "message": "Residente notificado" if result.get("sent") else "Error notificando",
-            }
-
-        elif tool_name == "abrir_porton":
-            # Abrir porton con parametros correctos
-            result = open_gate.invoke({
-                "condominium_id": condominium_id,
-                "door_id": 1,
-                "reason": params.get("motivo", "Autorizado por voz"),
-            })
-            return {
-                "opened": result.get("success", False),
-                "message": "Porton abierto" if result.get("success") else "Error abriendo porton",
-            }
-
-        elif tool_name == "denegar_acceso":
-            # Registrar denegacion con parametros correctos
-            result = log_access_event.invoke({
-                "condominium_id": condominium_id,
-                "entry_type": "intercom",
-                "access_decision": "denied",
-                "decision_reason": params.get("razon", "Denegado por agente"),
-                "decision_method": "voice_agent",
-            })
-            return {
-                "logged": result.get("success", False),
-                "message": "Acceso denegado registrado",
-            }
-
-        else:
-            logger.warning(f"Tool desconocido: {tool_name}")
-            return {"error": f"Tool '{tool_name}' no reconocido"}
-
+        return await handler(session.condominium_id, params)
     except Exception as e:
         logger.error(f"Error ejecutando tool {tool_name}: {e}")
         return {"error": str(e)}
 
 
+# ============================================
+# ACTORES POR LLAMADA
+# ============================================
+# Los webhooks de una misma llamada pueden llegar concurrentemente. Cada
+# call_id tiene una cola con un unico consumidor, de modo que sus eventos
+# se aplican en orden y sin pisarse el read-modify-write de la sesion.
+# Solo se crean actores para call.started o llamadas con sesion en el store:
+# un call_id inventado no deja una tarea viva.
+
+SESSION_ACTOR_IDLE_TIMEOUT = 30  # segundos sin eventos; el siguiente evento lo recrea
+
+EventHandler = Callable[[str, Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+
+class SessionActor:
+    """Procesa en serie los eventos de una llamada."""
+
+    def __init__(self, call_id: str):
+        self.call_id = call_id
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.task = asyncio.create_task(self.run())
+
+    async def submit(self, handler: EventHandler, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Encola un evento y espera el resultado de su handler."""
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((handler, data, future))
+        return await future
+
+    async def _process(self, handler: EventHandler, data: Dict[str, Any], future: asyncio.Future) -> bool:
+        """Ejecuta un evento. Retorna True si termino la llamada."""
+        try:
+            result = await handler(self.call_id, data)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(result)
+        finally:
+            # BaseException (ej. cancelacion): no dejar al caller esperando
+            if not future.done():
+                future.cancel()
+
+        return handler is handle_call_ended
+
+    async def run(self) -> None:
+        try:
+            while True:
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), SESSION_ACTOR_IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+
+                if await self._process(*item):
+                    break
+        finally:
+            if _session_actors.get(self.call_id) is self:
+                del _session_actors[self.call_id]
+
+            # Eventos encolados mientras el actor se cerraba
+            while not self.queue.empty():
+                await self._process(*self.queue.get_nowait())
+
+
+_session_actors: Dict[str, SessionActor] = {}
+
+
 # ============================================
 # HANDLER PRINCIPAL
 # ============================================
@@ -338,7 +850,7 @@ async def process_ultravox_webhook(
     Returns:
         Resultado del procesamiento
     """
-    logger.info(f"Procesando evento Ultravox: {event}")
+    logger.info("Procesando evento Ultravox: {} (call: {})", event, call_id)
 
     handlers = {
         "call.started": handle_call_started,
@@ -353,28 +865,47 @@ async def process_ultravox_webhook(
         logger.warning(f"Evento no manejado: {event}")
         return {"status": "unknown_event", "event": event}
 
-    return await handler(call_id, data)
+    # call_id queda en record["extra"] de todos los logs del handler y de las
+    # tareas que lance (create_task copia el contexto, incluido el actor)
+    with logger.contextualize(call_id=call_id):
+        actor = _session_actors.get(call_id)
+        if actor is None:
+            # Sin sesion no hay nada que serializar: el handler responde directo
+            # (session_not_found, error logueado, etc.) sin crear un actor
+            if handler is not handle_call_started and not await session_store.exists(call_id):
+                return await handler(call_id, data)
+
+            # Pudo crearse otro actor mientras se consultaba Redis
+            actor = _session_actors.get(call_id)
+            if actor is None:
+                actor = _session_actors[call_id] = SessionActor(call_id)
+
+        return await actor.submit(handler, data)
 
 
 # ============================================
 # UTILIDADES
 # ============================================
 
-def get_active_sessions() -> Dict[str, Dict[str, Any]]:
+async def get_active_sessions() -> Dict[str, Dict[str, Any]]:
     """Retorna las sesiones activas (para debugging)."""
     return {
         call_id: {
-            "session_id": s["session_id"],
-            "started_at": s["started_at"],
-            "transcript_count": len(s.get("transcript", [])),
+            "session_id": entry["session"]["session_id"],
+            "started_at": _iso(entry["session"]["started_ns"]),
+            "transcript_count": entry["transcript_count"],
         }
-        for call_id, s in active_sessions.items()
+        for call_id, entry in (await session_store.list_active()).items()
     }
 
 
-def get_session_transcript(call_id: str) -> list:
+async def get_session_transcript(call_id: str) -> List[Dict[str, Any]]:
     """Obtiene la transcripcion de una sesion."""
-    session = active_sessions.get(call_id)
-    if session:
-        return session.get("transcript", [])
-    return []
+    return [
+        {
+            "role": turn["role"],
+            "text": turn["text"],
+            "timestamp": _iso(turn["ts_ns"]),
+        }
+        for turn in await session_store.get_transcript(call_id)
+    ]
@@ -6,61 +6,9 @@ Este script prueba que "Daisy" pueda hacer match con "Deisy" en la base de datos
 """
 
 import sys
-import unicodedata
-from typing import List
-
-
-# Copiar las funciones necesarias del código
-def normalize_text(text: str) -> str:
-    """Remove accents and normalize text for search."""
-    if not text:
-        return text
-    # Normalize unicode and remove accents
-    normalized = unicodedata.normalize('NFD', text)
-    return ''.join(c for c in normalized if unicodedata.category(c) != 'Mn')
-
-
-PHONETIC_VARIATIONS = [
-    ("ai", "ei"),  # Daisy ↔ Deisy
-    ("ei", "ai"),  # Deisy ↔ Daisy
-    ("y", "i"),    # Daisy ↔ Daisi
-    ("i", "y"),    # Daisi ↔ Daisy
-    ("ll", "y"),   # Lluis ↔ Yuis
-    ("y", "ll"),   # Yolanda ↔ Llolanda (menos común pero posible)
-    ("b", "v"),    # Bictoria ↔ Victoria
-    ("v", "b"),    # Victoria ↔ Bictoria
-    ("s", "z"),    # Rosa ↔ Roza
-    ("z", "s"),    # Roza ↔ Rosa
-    ("c", "s"),    # Cecilia ↔ Sesilia
-    ("s", "c"),    # Sesilia ↔ Cecilia
-]
-
-
-def generate_phonetic_variations(text: str, max_variations: int = 5) -> List[str]:
-    """
-    Genera variaciones fonéticas de un texto para matching más robusto.
-    """
-    if not text:
-        return [text]
-
-    # Normalizar primero (quitar acentos)
-    text_normalized = normalize_text(text.lower().strip())
-
-    # Siempre incluir el original
-    variations = {text_normalized}
-
-    # Aplicar cada patrón de variación
-    for pattern_from, pattern_to in PHONETIC_VARIATIONS:
-        if pattern_from in text_normalized:
-            # Generar variación reemplazando el patrón
-            variation = text_normalized.replace(pattern_from, pattern_to)
-            variations.add(variation)
-
-            # Limitar el número de variaciones para evitar explosión combinatoria
-            if len(variations) >= max_variations:
-                break
-
-    return list(variations)
+
+# Usar la implementación de producción (sin copias que se desincronicen)
+from src.api.routes.tools import generate_phonetic_variations_set as generate_phonetic_variations
 
 
 def test_phonetic_matching():
@@ -87,8 +35,8 @@ def test_phonetic_matching():
     apellido_variations = generate_phonetic_variations(apellido_voice)
 
     print(f"\n🔄 VARIACIONES FONÉTICAS GENERADAS:")
-    print(f"   - Nombre '{nombre_voice}': {nombre_variations}")
-    print(f"   - Apellido '{apellido_voice}': {apellido_variations}")
+    print(f"   - Nombre '{nombre_voice}': {sorted(nombre_variations)}")
+    print(f"   - Apellido '{apellido_voice}': {sorted(apellido_variations)}")
 
     # Caso 2: Lo que está en la base de datos
     db_name = "Deisy Colorado"
@@ -107,20 +55,16 @@ def test_phonetic_matching():
     db_apellido_variations = generate_phonetic_variations(db_apellido)
 
     print(f"\n🔄 VARIACIONES FONÉTICAS DE DB:")
-    print(f"   - Nombre DB '{db_nombre}': {db_nombre_variations}")
-    print(f"   - Apellido DB '{db_apellido}': {db_apellido_variations}")
+    print(f"   - Nombre DB '{db_nombre}': {sorted(db_nombre_variations)}")
+    print(f"   - Apellido DB '{db_apellido}': {sorted(db_apellido_variations)}")
 
     # Verificar si hay match
     print(f"\n🔍 VERIFICANDO MATCH:")
 
     # Nombre match
-    nombre_match = False
-    nombre_matched_var = None
-    for v_variation in nombre_variations:
-        if v_variation in db_nombre_variations:
-            nombre_match = True
-            nombre_matched_var = v_variation
-            break
+    common = nombre_variations & db_nombre_variations
+    nombre_match = bool(common)
+    nombre_matched_var = min(common, default=None)
 
     if nombre_match:
         print(f"   ✅ NOMBRE MATCH: '{nombre_voice}' ↔ '{db_nombre}' (variación común: '{nombre_matched_var}')")
@@ -128,13 +72,10 @@ def test_phonetic_matching():
         print(f"   ❌ NOMBRE NO MATCH: '{nombre_voice}' ✗ '{db_nombre}'")
 
     # Apellido match
-    apellido_match = False
-    apellido_matched_var = None
-    for v_variation in apellido_variations:
-        if v_variation in db_apellido_variations or v_variation == db_apellido:
-            apellido_match = True
-            apellido_matched_var = v_variation
-            break
+    # db_apellido siempre está en sus propias variaciones (se incluye el original)
+    common = apellido_variations & db_apellido_variations
+    apellido_match = bool(common)
+    apellido_matched_var = min(common, default=None)
 
     if apellido_match:
         print(f"   ✅ APELLIDO MATCH: '{apellido_voice}' ↔ '{db_apellido}' (variación: '{apellido_matched_var}')")
@@ -174,14 +115,14 @@ def test_other_cases():
         db_vars = generate_phonetic_variations(db_name.lower())
 
         # Buscar variación común
-        common = set(input_vars) & set(db_vars)
+        common = input_vars & db_vars
 
         if common:
-            print(f"\n✅ '{input_name}' ↔ '{db_name}': MATCH (variación común: {common})")
+            print(f"\n✅ '{input_name}' ↔ '{db_name}': MATCH (variación común: {sorted(common)})")
         else:
             print(f"\n❌ '{input_name}' ✗ '{db_name}': NO MATCH")
-            print(f"   Input vars: {input_vars}")
-            print(f"   DB vars: {db_vars}")
+            print(f"   Input vars: {sorted(input_vars)}")
+            print(f"   DB vars: {sorted(db_vars)}")
 
 
 if __name__ == "__main__":
@@ -8,8 +8,15 @@ print("🧪 SITNOVA - Test Simple del Agente")
 print("=" * 60)
 print()
 
-# Simular estado del agente
+from collections import deque
+
+# Simular estado del agente (slots: sin __dict__ por instancia)
 class MockState:
+    __slots__ = (
+        "session_id", "condominium_id", "plate", "is_authorized",
+        "gate_opened", "access_logged", "messages", "current_step",
+    )
+
     def __init__(self):
         self.session_id = "test-001"
         self.condominium_id = "condo-123"
@@ -17,7 +24,7 @@ class MockState:
         self.is_authorized = False
         self.gate_opened = False
         self.access_logged = False
-        self.messages = []
+        self.messages = deque()
         self.current_step = "INICIO"
 
     def __repr__(self):
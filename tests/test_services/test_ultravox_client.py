@@ -0,0 +1,261 @@
+"""
+Tests del cliente de Ultravox: circuit breaker y reintentos de _request.
+
+Las respuestas de Ultravox se simulan con httpx.MockTransport.
+"""
+import asyncio
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+
+from src.services.voice import ultravox_client as uc
+from src.services.voice.ultravox_client import (
+    CircuitBreaker,
+    UltravoxClient,
+    UltravoxUnavailableError,
+)
+
+
+# ============================================
+# CIRCUIT BREAKER
+# ============================================
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(uc.time, "monotonic", fake)
+    return fake
+
+
+def open_breaker(breaker: CircuitBreaker) -> None:
+    for _ in range(breaker.fail_max):
+        breaker.before_request()
+        breaker.record_failure()
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(fail_max=3, reset_timeout=30)
+
+    breaker.record_failure()
+    breaker.record_failure()
+    assert not breaker.is_open
+    breaker.record_failure()
+
+    assert breaker.is_open
+    with pytest.raises(UltravoxUnavailableError):
+        breaker.before_request()
+
+
+def test_success_resets_failure_count(clock):
+    breaker = CircuitBreaker(fail_max=3, reset_timeout=30)
+
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+
+    assert not breaker.is_open
+
+
+def test_half_open_lets_a_single_probe_through(clock):
+    breaker = CircuitBreaker(fail_max=2, reset_timeout=30)
+    open_breaker(breaker)
+
+    clock.now += 31
+    assert breaker.before_request() is True
+    # Mientras la prueba esta en curso, el resto falla al instante
+    with pytest.raises(UltravoxUnavailableError):
+        breaker.before_request()
+
+
+def test_successful_probe_closes_the_circuit(clock):
+    breaker = CircuitBreaker(fail_max=2, reset_timeout=30)
+    open_breaker(breaker)
+
+    clock.now += 31
+    breaker.before_request()
+    breaker.record_success()
+
+    assert not breaker.is_open
+    assert breaker.before_request() is False
+    assert breaker.before_request() is False
+
+
+def test_failed_probe_reopens_for_another_timeout(clock):
+    breaker = CircuitBreaker(fail_max=2, reset_timeout=30)
+    open_breaker(breaker)
+
+    clock.now += 31
+    breaker.before_request()
+    breaker.record_failure()
+
+    with pytest.raises(UltravoxUnavailableError):
+        breaker.before_request()
+    clock.now += 31
+    assert breaker.before_request() is True
+
+
+def test_released_probe_lets_the_next_request_probe(clock):
+    breaker = CircuitBreaker(fail_max=2, reset_timeout=30)
+    open_breaker(breaker)
+
+    clock.now += 31
+    breaker.before_request()
+    breaker.release_probe()
+
+    assert breaker.before_request() is True
+
+
+# ============================================
+# REINTENTOS
+# ============================================
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    """Registra las esperas de backoff sin dormir."""
+    delays = []
+
+    async def fake_sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(uc.asyncio, "sleep", fake_sleep)
+    return delays
+
+
+def make_client(responses) -> UltravoxClient:
+    """Cliente cuyo transporte responde en orden con `responses` (Response o excepcion)."""
+    pending = iter(responses)
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        response = next(pending)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    client = UltravoxClient(api_key="test")
+    client._client = httpx.AsyncClient(
+        base_url=UltravoxClient.BASE_URL,
+        transport=httpx.MockTransport(handler),
+    )
+    return client
+
+
+@pytest.mark.asyncio
+async def test_retries_429_honouring_retry_after_seconds(no_sleep):
+    client = make_client([
+        httpx.Response(429, headers={"Retry-After": "3"}),
+        httpx.Response(200, json={}),
+    ])
+
+    response = await client._request("GET", "/calls/x")
+
+    assert response.status_code == 200
+    assert no_sleep == [3.0]
+
+
+@pytest.mark.asyncio
+async def test_retry_after_accepts_http_date(no_sleep):
+    when = datetime.now(timezone.utc) + timedelta(seconds=5)
+    client = make_client([
+        httpx.Response(429, headers={"Retry-After": format_datetime(when, usegmt=True)}),
+        httpx.Response(200, json={}),
+    ])
+
+    await client._request("GET", "/calls/x")
+
+    assert 3 <= no_sleep[0] <= 5
+
+
+@pytest.mark.asyncio
+async def test_retry_after_above_max_is_not_retried(no_sleep):
+    client = make_client([
+        httpx.Response(429, headers={"Retry-After": str(int(uc.RETRY_AFTER_MAX) + 50)}),
+    ])
+
+    response = await client._request("GET", "/calls/x")
+
+    assert response.status_code == 429
+    assert no_sleep == []
+
+
+@pytest.mark.asyncio
+async def test_without_retry_after_uses_backoff(no_sleep):
+    client = make_client([
+        httpx.Response(503),
+        httpx.Response(503),
+        httpx.Response(503),
+    ])
+
+    response = await client._request("GET", "/calls/x")
+
+    assert response.status_code == 503
+    assert len(no_sleep) == uc.MAX_ATTEMPTS - 1
+    assert 0.5 <= no_sleep[0] <= 1.0
+
+
+@pytest.mark.asyncio
+async def test_open_circuit_fails_fast():
+    client = make_client([])
+    client._breaker = CircuitBreaker(fail_max=1, reset_timeout=30)
+    client._breaker.record_failure()
+
+    with pytest.raises(UltravoxUnavailableError):
+        await client._request("GET", "/calls/x")
+
+
+@pytest.mark.asyncio
+async def test_only_one_probe_in_flight(clock, monkeypatch):
+    release = asyncio.Event()
+    requests = []
+
+    async def slow_request(method, url, **kwargs):
+        requests.append(url)
+        await release.wait()
+        return httpx.Response(200, json={})
+
+    client = make_client([])
+    client._breaker = CircuitBreaker(fail_max=1, reset_timeout=30)
+    client._breaker.record_failure()
+    monkeypatch.setattr(client._client, "request", slow_request)
+    clock.now += 31
+
+    probe = asyncio.create_task(client._request("GET", "/calls/probe"))
+    await asyncio.sleep(0)
+    with pytest.raises(UltravoxUnavailableError):
+        await client._request("GET", "/calls/other")
+
+    release.set()
+    assert (await probe).status_code == 200
+    assert requests == ["/calls/probe"]
+    assert not client._breaker.is_open
+
+
+@pytest.mark.asyncio
+async def test_cancelled_probe_is_released(clock, monkeypatch):
+    async def hanging_request(method, url, **kwargs):
+        await asyncio.Event().wait()
+
+    client = make_client([])
+    client._breaker = CircuitBreaker(fail_max=1, reset_timeout=30)
+    client._breaker.record_failure()
+    monkeypatch.setattr(client._client, "request", hanging_request)
+    clock.now += 31
+
+    probe = asyncio.create_task(client._request("GET", "/calls/probe"))
+    await asyncio.sleep(0)
+    probe.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await probe
+
+    assert client._breaker.before_request() is True
@@ -0,0 +1,374 @@
+"""
+Tests del manejador de webhooks de Ultravox: sesiones en Redis, escritura
+de transcripciones en lotes, actores por llamada y firma del webhook.
+
+Redis se reemplaza por fakeredis; no hace falta un servidor.
+"""
+import asyncio
+import hmac
+import importlib
+import time
+
+import fakeredis
+import pytest
+import pytest_asyncio
+
+from src.config.settings import settings
+from src.services.voice import webhook_handler as wh
+
+
+CALL_ID = "call-test"
+
+
+@pytest_asyncio.fixture
+async def redis(monkeypatch):
+    """SessionStore apuntando a un Redis en memoria; detiene drainer y actores al final."""
+    fake = fakeredis.aioredis.FakeRedis()
+    monkeypatch.setattr(wh.session_store, "_redis", fake)
+    yield fake
+
+    await wh.stop_transcript_drainer()
+    tasks = [actor.task for actor in wh._session_actors.values()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    wh._session_actors.clear()
+    await fake.aclose()
+
+
+async def start_call(call_id: str = CALL_ID) -> None:
+    await wh.process_ultravox_webhook("call.started", call_id, {"metadata": {}})
+
+
+async def send_turns(call_id: str, texts) -> None:
+    for text in texts:
+        await wh.handle_call_transcript(call_id, {"transcript": {"role": "user", "text": text}})
+
+
+async def transcript_texts(call_id: str = CALL_ID):
+    return [t["text"] for t in await wh.session_store.get_transcript(call_id)]
+
+
+# ============================================
+# SESSION STORE
+# ============================================
+
+@pytest.mark.asyncio
+async def test_append_turns_returns_session_and_length(redis):
+    session = wh.Session(session_id="s1", state={}, started_ns=time.time_ns())
+    await wh.session_store.set(CALL_ID, session)
+
+    appended = await wh.session_store.append_turns({
+        CALL_ID: [wh.Turn("user", "hola", 1), wh.Turn("agent", "buenas", 2)],
+        "call-sin-sesion": [wh.Turn("user", "x", 3)],
+    })
+
+    assert appended[CALL_ID] == (session, 2)
+    assert appended["call-sin-sesion"] == (None, 1)
+
+
+@pytest.mark.asyncio
+async def test_overflow_is_archived_in_order(redis, monkeypatch):
+    monkeypatch.setattr(wh, "TRANSCRIPT_MAX_TURNS", 4)
+    await start_call()
+
+    texts = [f"t{i}" for i in range(10)]
+    await send_turns(CALL_ID, texts)
+    await wh.flush_transcripts(CALL_ID)
+
+    assert await redis.llen(wh.session_store.transcript_key(CALL_ID)) == 4
+    assert await redis.llen(wh.session_store.archive_key(CALL_ID)) == 6
+    assert await transcript_texts() == texts
+
+
+@pytest.mark.asyncio
+async def test_delete_removes_transcript_and_archive(redis, monkeypatch):
+    monkeypatch.setattr(wh, "TRANSCRIPT_MAX_TURNS", 1)
+    await start_call()
+    await send_turns(CALL_ID, ["a", "b", "c"])
+    await wh.flush_transcripts(CALL_ID)
+
+    await wh.session_store.delete(CALL_ID)
+
+    assert await redis.keys("*") == []
+
+
+# ============================================
+# DRAINER DE TRANSCRIPCIONES
+# ============================================
+
+@pytest.mark.asyncio
+async def test_transcript_for_unknown_call_is_not_queued(redis):
+    result = await wh.handle_call_transcript("call-desconocida", {"transcript": {"text": "x"}})
+
+    assert result == {"status": "session_not_found"}
+    assert "call-desconocida" not in wh._pending_turns
+
+
+@pytest.mark.asyncio
+async def test_failed_append_is_retried(redis, monkeypatch):
+    await start_call()
+    append_turns = wh.session_store.append_turns
+    calls = []
+
+    async def flaky_append(turns_by_call):
+        calls.append(turns_by_call)
+        if len(calls) == 1:
+            raise ConnectionError("redis caido")
+        return await append_turns(turns_by_call)
+
+    monkeypatch.setattr(wh.session_store, "append_turns", flaky_append)
+
+    await send_turns(CALL_ID, ["t0", "t1", "t2"])
+    await wh.flush_transcripts(CALL_ID)
+
+    # El lote que fallo se reintenta tal cual
+    assert calls[1] == calls[0]
+    assert await transcript_texts() == ["t0", "t1", "t2"]
+
+
+@pytest.mark.asyncio
+async def test_batch_is_dropped_after_last_attempt(redis, monkeypatch):
+    monkeypatch.setattr(wh, "TRANSCRIPT_SAVE_ATTEMPTS", 2)
+    await start_call()
+
+    async def failing_append(turns_by_call):
+        raise ConnectionError("redis caido")
+
+    monkeypatch.setattr(wh.session_store, "append_turns", failing_append)
+
+    await send_turns(CALL_ID, ["t0"])
+    # No queda colgado aunque el lote se pierda
+    await asyncio.wait_for(wh.flush_transcripts(CALL_ID), timeout=5)
+
+    assert CALL_ID not in wh._pending_turns
+    assert await transcript_texts() == []
+
+
+@pytest.mark.asyncio
+async def test_archive_failure_does_not_duplicate_turns(redis, monkeypatch):
+    monkeypatch.setattr(wh, "TRANSCRIPT_MAX_TURNS", 2)
+    await start_call()
+
+    async def failing_archive(call_id, count):
+        raise ConnectionError("redis caido")
+
+    monkeypatch.setattr(wh.session_store, "archive_overflow", failing_archive)
+
+    await send_turns(CALL_ID, ["t0", "t1", "t2"])
+    await wh.flush_transcripts(CALL_ID)
+
+    assert await transcript_texts() == ["t0", "t1", "t2"]
+
+
+@pytest.mark.asyncio
+async def test_call_ended_flushes_its_transcript_before_delete(redis, monkeypatch):
+    await start_call("call-a")
+    await start_call("call-b")
+
+    delete = wh.session_store.delete
+    seen_at_delete = {}
+
+    async def recording_delete(call_id):
+        seen_at_delete[call_id] = await transcript_texts(call_id)
+        await delete(call_id)
+
+    monkeypatch.setattr(wh.session_store, "delete", recording_delete)
+
+    await send_turns("call-a", ["a0", "a1", "a2"])
+    await send_turns("call-b", ["b0"])
+    await wh.process_ultravox_webhook("call.ended", "call-a", {"reason": "hangup"})
+
+    assert seen_at_delete["call-a"] == ["a0", "a1", "a2"]
+    assert not await wh.session_store.exists("call-a")
+    assert await wh.session_store.exists("call-b")
+
+
+def test_drainer_restarts_on_a_new_event_loop(monkeypatch):
+    """Dos lifespans seguidos (dos event loops) no comparten la cola del drainer."""
+    server = fakeredis.FakeServer()
+
+    async def lifespan(text):
+        monkeypatch.setattr(wh.session_store, "_redis", fakeredis.aioredis.FakeRedis(server=server))
+        await wh.session_store.set(CALL_ID, wh.Session(session_id="s", state={}, started_ns=0))
+        await send_turns(CALL_ID, [text])
+        await wh.flush_transcripts(CALL_ID)
+        await wh.close_session_store()
+
+    asyncio.run(lifespan("primero"))
+    asyncio.run(lifespan("segundo"))
+
+    async def read():
+        monkeypatch.setattr(wh.session_store, "_redis", fakeredis.aioredis.FakeRedis(server=server))
+        try:
+            return await transcript_texts()
+        finally:
+            await wh.session_store.close()
+
+    assert asyncio.run(read()) == ["primero", "segundo"]
+    assert wh._transcript_queue is None
+
+
+@pytest.mark.asyncio
+async def test_stop_logs_drainer_error_instead_of_raising(redis, monkeypatch):
+    async def broken_drainer(queue):
+        raise RuntimeError("drainer roto")
+
+    monkeypatch.setattr(wh, "_transcript_drainer", broken_drainer)
+    wh.start_transcript_drainer()
+    await asyncio.sleep(0)
+
+    await wh.stop_transcript_drainer()
+
+    assert wh._transcript_drainer_task is None
+    assert wh._transcript_queue is None
+
+
+# ============================================
+# ACTORES POR LLAMADA
+# ============================================
+
+@pytest.mark.asyncio
+async def test_actor_processes_events_in_order(redis):
+    actor = wh.SessionActor(CALL_ID)
+    processed = []
+
+    def handler_sleeping(delay):
+        async def handler(call_id, data):
+            await asyncio.sleep(delay)
+            processed.append(data["n"])
+            return {"n": data["n"]}
+        return handler
+
+    # El primero es el mas lento: sin serializar terminaria ultimo
+    results = await asyncio.gather(*(
+        actor.submit(handler_sleeping(0.01 * (5 - n)), {"n": n}) for n in range(5)
+    ))
+
+    assert processed == [0, 1, 2, 3, 4]
+    assert [r["n"] for r in results] == [0, 1, 2, 3, 4]
+    wh._session_actors[CALL_ID] = actor  # lo cancela el fixture
+
+
+@pytest.mark.asyncio
+async def test_actor_handler_error_reaches_caller_and_actor_continues(redis):
+    actor = wh.SessionActor(CALL_ID)
+
+    async def failing(call_id, data):
+        raise ValueError("fallo")
+
+    async def ok(call_id, data):
+        return {"status": "ok"}
+
+    with pytest.raises(ValueError):
+        await actor.submit(failing, {})
+    assert await actor.submit(ok, {}) == {"status": "ok"}
+    wh._session_actors[CALL_ID] = actor  # lo cancela el fixture
+
+
+@pytest.mark.asyncio
+async def test_actor_exits_when_idle(redis, monkeypatch):
+    monkeypatch.setattr(wh, "SESSION_ACTOR_IDLE_TIMEOUT", 0.05)
+    await start_call()
+    actor = wh._session_actors[CALL_ID]
+
+    await asyncio.wait_for(actor.task, timeout=1)
+
+    assert CALL_ID not in wh._session_actors
+    # El siguiente evento crea un actor nuevo
+    await send_turns(CALL_ID, ["t0"])
+    result = await wh.process_ultravox_webhook("call.transcript", CALL_ID, {"transcript": {"text": "t1"}})
+    assert result["status"] == "transcript_queued"
+    assert wh._session_actors[CALL_ID] is not actor
+
+
+@pytest.mark.asyncio
+async def test_actor_exits_on_call_ended(redis):
+    await start_call()
+    actor = wh._session_actors[CALL_ID]
+
+    await wh.process_ultravox_webhook("call.ended", CALL_ID, {})
+    await asyncio.wait_for(actor.task, timeout=1)
+
+    assert CALL_ID not in wh._session_actors
+
+
+@pytest.mark.asyncio
+async def test_event_for_unknown_call_does_not_create_actor(redis):
+    result = await wh.process_ultravox_webhook("call.transcript", "call-desconocida", {})
+
+    assert result == {"status": "session_not_found"}
+    assert "call-desconocida" not in wh._session_actors
+
+
+# ============================================
+# FIRMA DEL WEBHOOK
+# ============================================
+
+SECRET = "secreto-de-prueba"
+PAYLOAD = b'{"event": "call.started"}'
+
+
+def sign(payload: bytes = PAYLOAD, secret: str = SECRET) -> str:
+    return hmac.new(secret.encode(), payload, "sha256").hexdigest()
+
+
+@pytest.fixture
+def load_handler(monkeypatch):
+    """Recarga el modulo con otro entorno/secret (la variante se elige al importar)."""
+    def load(environment: str, secret: str):
+        monkeypatch.setattr(settings, "environment", environment)
+        monkeypatch.setattr(settings, "ultravox_webhook_secret", secret)
+        return importlib.reload(wh)
+
+    yield load
+
+    monkeypatch.undo()
+    importlib.reload(wh)
+
+
+@pytest.mark.parametrize("environment", ["development", "production"])
+def test_valid_signature_is_accepted(load_handler, environment):
+    handler = load_handler(environment, SECRET)
+
+    assert handler.verify_ultravox_signature(sign(), PAYLOAD)
+    assert handler.verify_ultravox_signature("sha256=" + sign(), PAYLOAD)
+
+
+@pytest.mark.parametrize("signature", [
+    None,
+    "",
+    "sha256=",
+    "abc123",                      # longitud invalida
+    sign()[:-2],                   # truncada
+    sign() + "00",                 # de mas
+    "zz" + sign()[2:],             # no es hex
+    sign(b"otro payload"),         # de otro payload
+    sign(secret="otro-secret"),    # de otro secret
+])
+@pytest.mark.parametrize("environment", ["development", "production"])
+def test_invalid_signature_is_rejected(load_handler, environment, signature):
+    handler = load_handler(environment, SECRET)
+
+    assert not handler.verify_ultravox_signature(signature, PAYLOAD)
+
+
+def test_explicit_secret_overrides_settings(load_handler):
+    handler = load_handler("production", SECRET)
+
+    assert handler.verify_ultravox_signature(sign(secret="otro"), PAYLOAD, secret="otro")
+    assert not handler.verify_ultravox_signature(sign(), PAYLOAD, secret="otro")
+
+
+def test_development_without_secret_accepts(load_handler):
+    handler = load_handler("development", "")
+
+    assert handler.verify_ultravox_signature(None, PAYLOAD)
+
+
+@pytest.mark.parametrize("environment", ["staging", "production"])
+def test_non_development_without_secret_rejects(load_handler, environment):
+    handler = load_handler(environment, "")
+
+    assert not handler.verify_ultravox_signature(None, PAYLOAD)
+    assert not handler.verify_ultravox_signature(sign(), PAYLOAD)